@@ -1,20 +1,263 @@
-from openai import OpenAI
-from openai import APIConnectionError, APIError, RateLimitError
+# openai（连同 httpx、pydantic）导入较慢，推迟到首次创建客户端或处理错误时
+import itertools
 import json
+import random
+import threading
+import time
+import bazi_metrics as metrics
+from bazi_cache import cache_key
+from bazi_providers import get_registry, is_provider_failure
+from bazi_stream import StreamingAnalysis, StreamProcessor
+
+BASE_URL = "https://api.siliconflow.cn/v1"  # 指定SiliconFlow接口地址
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key: str, base_url: str = BASE_URL):
+    """按 (密钥, 地址) 复用同一个客户端，共享其HTTP连接池"""
+    from openai import OpenAI
+
+    key = (api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            with metrics.span("bazi_client_create_seconds"):
+                client = _clients[key] = OpenAI(api_key=api_key, base_url=base_url)
+        return client
+
+
+_hedge_pool = None
+
+
+def _get_hedge_pool():
+    """对冲与故障切换请求使用的线程池"""
+    global _hedge_pool
+    from concurrent.futures import ThreadPoolExecutor
+
+    with _clients_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="bazi-hedge")
+        return _hedge_pool
+
+
+def _has_output(chunk) -> bool:
+    if not chunk.choices:
+        return False
+    delta = chunk.choices[0].delta
+    return bool(delta.content or getattr(delta, "reasoning_content", None))
+
+
+def _prime_stream(response):
+    """读到首个有内容的片段为止，返回从头开始的片段迭代器"""
+    iterator = iter(response)
+    head = []
+    for chunk in iterator:
+        head.append(chunk)
+        if _has_output(chunk):
+            break
+    return itertools.chain(head, iterator)
+
+
+async def _aprime_stream(response):
+    iterator = response.__aiter__()
+    head = []
+    async for chunk in iterator:
+        head.append(chunk)
+        if _has_output(chunk):
+            break
+
+    async def chain():
+        for chunk in head:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+
+    return chain()
+
+
+class _Attempt:
+    """发往某个服务的一次请求；对冲落败时 cancel 关闭其响应"""
+
+    def __init__(self, provider, hedged: bool):
+        self.provider = provider
+        self.hedged = hedged
+        self.response = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def set_response(self, response) -> bool:
+        """登记响应，已被取消时返回 False"""
+        with self._lock:
+            self.response = response
+            return not self.cancelled
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            response = self.response
+        if response is not None:
+            response.close()
+
 
 class BaziAnalyzer:
     SUPPORTED_MODELS = [
         "deepseek-ai/DeepSeek-R1"     # 推理模型
     ]
+    PROMPT_VERSION = 1  # 修改 _build_messages 的模板时递增，使旧缓存失效
+    TEMPERATURE = 0.3   # 降低随机性
+    TOP_P = 0.9
+    MAX_TOKENS = 1000
+    REPLAY_CHUNK_CHARS = 16
      
-    def __init__(self, api_key: str, model: str = "deepseek-ai/DeepSeek-R1"):
-        
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url="https://api.siliconflow.cn/v1"  # 指定SiliconFlow接口地址
-        )
+    def __init__(self, api_key: str, model: str = "deepseek-ai/DeepSeek-R1",
+                 base_url: str = None, cache=None, providers=None, hedge: bool = True):
+        """providers 为 ProviderRegistry，省略时按 base_url 或配置文件取共享注册表；
+        hedge 为 False 时只做故障切换，不发对冲请求"""
+        self.api_key = api_key
+        self.providers = providers or get_registry(base_url)
         self.model = model
+        self.cache = cache
+        self.hedge = hedge
+
+    @classmethod
+    def available_models(cls) -> list:
+        """注册表中配置的模型，未配置时为 SUPPORTED_MODELS"""
+        return get_registry().models() or list(cls.SUPPORTED_MODELS)
+
+    def _request_params(self, report: dict) -> dict:
+        return {"messages": self._build_messages(report), "temperature": self.TEMPERATURE,
+                "top_p": self.TOP_P, "max_tokens": self.MAX_TOKENS}
+
+    def _open(self, attempt: _Attempt, stream: bool, params: dict, failover: bool = False):
+        """在 attempt 对应的服务上发出请求；流式时等到首个片段。被取消时返回 None
+
+        failover 为 True 时关闭SDK自带的重试，出错立即交给 _request 切换服务。
+        """
+        provider = attempt.provider
+        client = get_client(provider.api_key or self.api_key, provider.base_url)
+        if failover:
+            client = client.with_options(max_retries=0)
+        started = time.perf_counter()
+        try:
+            response = client.chat.completions.create(
+                model=provider.model_name(self.model), stream=stream, **params)
+            if not attempt.set_response(response):
+                if stream:
+                    response.close()
+                self.providers.record_cancel(provider, time.perf_counter() - started, stream)
+                return None
+            chunks = _prime_stream(response) if stream else None
+            if attempt.cancelled:
+                self.providers.record_cancel(provider, time.perf_counter() - started, stream)
+                return None
+        except Exception as e:
+            if attempt.cancelled:
+                self.providers.record_cancel(provider, time.perf_counter() - started, stream)
+                return None
+            self.providers.record_failure(provider, e)
+            raise
+        self.providers.record_success(provider, time.perf_counter() - started, stream)
+        return response, chunks
+
+    def _request(self, stream: bool, params: dict, on_cancel=None):
+        """按注册表发出请求，返回 (响应, 流式片段迭代器或 None)
+
+        服务出错时切换到下一个；hedge 开启时首个服务超过其 p95 延迟仍未出字，
+        就同时向下一个服务发出请求，先返回的胜出，其余关闭。全部失败时抛出最后的错误。
+        on_cancel(closer) 在每个请求发出前调用（如 Job.on_cancel）：取消时关闭该请求，
+        等待中的调用立即抛出 CancelledError。
+        """
+        from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, wait
+
+        candidates = self.providers.candidates(self.model)
+        first = self._next_candidate(candidates)
+        failover = bool(candidates)
+        if not failover and on_cancel is None:
+            return self._open(_Attempt(first, False), stream, params)
+
+        pool = _get_hedge_pool()
+        pending = {}
+        last_error = None
+        cancelled = Future()
+        if on_cancel is not None:
+            on_cancel(lambda: cancelled.done() or cancelled.set_result(None))
+
+        def launch(provider, hedged: bool) -> _Attempt:
+            attempt = _Attempt(provider, hedged)
+            if on_cancel is not None:
+                on_cancel(attempt.cancel)
+            pending[pool.submit(self._open, attempt, stream, params, failover)] = attempt
+            return attempt
+
+        latest = launch(first, False)
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and candidates:
+                    timeout = self.providers.hedge_delay(latest.provider, stream)
+                done, _ = wait([*pending, cancelled], timeout, return_when=FIRST_COMPLETED)
+                if cancelled.done():
+                    raise CancelledError("请求已取消")
+                if not done:
+                    provider = self._next_candidate(candidates, required=False)
+                    if provider is not None:
+                        metrics.inc("bazi_hedge_total")
+                        latest = launch(provider, True)
+                    continue
+                for future in done:
+                    attempt = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if not is_provider_failure(e):
+                            raise
+                        last_error = e
+                        continue
+                    if attempt.hedged:
+                        metrics.inc("bazi_hedge_wins_total")
+                    return result
+                if not pending:
+                    provider = self._next_candidate(candidates, required=False)
+                    if provider is not None:
+                        metrics.inc("bazi_failover_total")
+                        latest = launch(provider, False)
+        finally:
+            for attempt in pending.values():
+                attempt.cancel()
+        raise last_error
+
+    def _next_candidate(self, candidates: list, required: bool = True):
+        """从 candidates 中取出下一个能发出请求的服务（见 ProviderRegistry.begin）
+
+        没有可用服务时 required 为 True 则报错，否则返回 None。
+        """
+        exhausted = not candidates
+        while candidates:
+            provider = candidates.pop(0)
+            if self.providers.begin(provider):
+                return provider
+        if not required:
+            return None
+        if exhausted:
+            raise ValueError(f"没有支持模型 {self.model} 的服务")
+        raise ValueError("所有服务均已熔断，请稍后重试")
+
+    def _cache_key(self, report: dict) -> str:
+        return cache_key(report, self.model, self.TEMPERATURE, self.TOP_P,
+                         self.PROMPT_VERSION, self.MAX_TOKENS)
+
+    def _replay_stream(self, content: str):
+        """把缓存的完整回答按块回放"""
+        for i in range(0, len(content), self.REPLAY_CHUNK_CHARS):
+            yield content[i:i + self.REPLAY_CHUNK_CHARS]
+
+    def _cache_on_complete(self, key: str):
+        """流式输出完整结束后写入缓存"""
+        return lambda result: self.cache.put(key, result.content)
 
+    @metrics.timed("bazi_build_messages_seconds")
     def _build_messages(self, report: dict) -> list:
         return [{
             "role": "system",
@@ -38,21 +281,46 @@ class BaziAnalyzer:
             - 重要结论前添加表情符号"""
             }]
 
-    def analyze(self, report: dict, stream: bool = False) -> str:
+    def analyze(self, report: dict, stream: bool = False, on_response=None, on_section=None,
+                on_cancel=None):
+        """on_response 在请求发出后以原始响应对象调用
+
+        on_cancel(closer) 在请求发出前登记中止回调（如 Job.on_cancel），取消时立即关闭请求；
+        此时非流式分析也以流式请求发出并在本地拼接，关闭连接即可让服务端停止生成。
+        stream=True 时返回 StreamingAnalysis（迭代得到正文片段，on_section 逐节回调）；
+        出错时返回错误信息字符串。
+        """
+        from openai import APIConnectionError, APIError, RateLimitError
+
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(report)
+            cached = self.cache.get(key)
+            if cached is not None:
+                if stream:
+                    return StreamingAnalysis(((chunk, None) for chunk in self._replay_stream(cached)),
+                                             on_section)
+                return cached
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=self._build_messages(report),
-                temperature=0.3,  # 降低随机性
-                top_p=0.9,
-                max_tokens=1000,
-                stream=stream     # 支持流式输出
-            )
+            params = self._request_params(report)
+            started = time.perf_counter()
+            # 支持流式输出；可取消的非流式请求同样以流式发出
+            response, chunks = self._request(stream or on_cancel is not None, params, on_cancel)
+            if on_response is not None:
+                on_response(response)
             
-            if stream:
-                return self._handle_stream_response(response)
+            if stream or on_cancel is not None:
+                analysis = self._handle_stream_response(
+                    response, started, on_section,
+                    self._cache_on_complete(key) if key else None, chunks)
+                return analysis if stream else analysis.result().content
             else:
-                return response.choices[0].message.content
+                metrics.observe("bazi_llm_request_seconds", time.perf_counter() - started)
+                content = response.choices[0].message.content
+                if key:
+                    self.cache.put(key, content)
+                return content
 
         except APIConnectionError as e:
             return f"连接失败：{e.__cause__}"
@@ -63,29 +331,310 @@ class BaziAnalyzer:
         except Exception as e:
             return f"未知错误：{str(e)}"
 
-    def _handle_stream_response(self, response):
-        """处理流式响应"""
-        full_content = ""
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
-                full_content += chunk.choices[0].delta.content
-        return full_content
+    def _handle_stream_response(self, response, started: float = None, on_section=None,
+                                on_complete=None, chunks=None) -> StreamingAnalysis:
+        """处理流式响应，started 为请求发出时刻（用于统计首字延迟），
+        chunks 为已读过开头的片段迭代器（见 _request），省略时直接迭代 response"""
+        # 提前结束迭代时也释放HTTP连接
+        return StreamingAnalysis(self._stream_deltas(chunks or response, started), on_section,
+                                 on_complete, close=response.close)
+
+    @staticmethod
+    def _stream_deltas(chunks, started: float = None):
+        """逐块取出 (正文, 推理内容)，推理模型的思考过程在 reasoning_content 中"""
+        timer = metrics.StreamTimer("bazi_llm", started)
+        for chunk in chunks:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            content = delta.content
+            reasoning = getattr(delta, "reasoning_content", None)
+            if content or reasoning:
+                timer.chunk(content or reasoning)
+                yield content, reasoning
+        timer.finish()
     
-    def analyze_with_history(self, messages: list, stream=False):
-        """支持历史记录的对话"""
+    def analyze_with_history(self, messages: list, stream=False, on_response=None, on_cancel=None):
+        """支持历史记录的对话；on_cancel 同 analyze"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.5,
-                stream=stream
-            )
+            started = time.perf_counter()
+            response, chunks = self._request(stream or on_cancel is not None,
+                                             {"messages": messages, "temperature": 0.5}, on_cancel)
+            if on_response is not None:
+                on_response(response)
             
-            if stream:
-                return (chunk.choices[0].delta.content for chunk in response)
+            if stream or on_cancel is not None:
+                analysis = self._handle_stream_response(response, started, chunks=chunks)
+                return analysis if stream else analysis.result().content
             else:
+                metrics.observe("bazi_llm_request_seconds", time.perf_counter() - started)
                 return response.choices[0].message.content
                 
         except Exception as e:
-            return f"[API错误] {str(e)}"
\ No newline at end of file
+            return f"[API错误] {str(e)}"
+
+
+class AsyncBaziAnalyzer(BaziAnalyzer):
+    """异步分析器：复用一个连接池客户端，并发受信号量限制，遇限流退避重试
+
+    async with AsyncBaziAnalyzer(api_key, concurrency=16) as analyzer:
+        results = await analyzer.analyze_many(reports)
+    """
+
+    def __init__(self, api_key: str, model: str = "deepseek-ai/DeepSeek-R1",
+                 base_url: str = None, concurrency: int = 8, max_retries: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 60.0, cache=None,
+                 providers=None, hedge: bool = True):
+        super().__init__(api_key, model, base_url, cache, providers, hedge)
+        self._clients = {}
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.close()
+
+    def _client_for(self, provider):
+        client = self._clients.get(provider.name)
+        if client is None:
+            from openai import AsyncOpenAI
+
+            # 限流重试由本类负责，关闭SDK自带的重试
+            with metrics.span("bazi_client_create_seconds"):
+                client = self._clients[provider.name] = AsyncOpenAI(
+                    api_key=provider.api_key or self.api_key, base_url=provider.base_url,
+                    max_retries=0)
+        return client
+
+    async def _aopen(self, provider, stream: bool, params: dict):
+        import asyncio
+
+        client = self._client_for(provider)
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await client.chat.completions.create(
+                model=provider.model_name(self.model), stream=stream, **params)
+            chunks = await _aprime_stream(response) if stream else None
+        except asyncio.CancelledError:
+            # 对冲落败：关闭已建立的流
+            self.providers.record_cancel(provider, time.perf_counter() - started, stream)
+            if stream and response is not None:
+                await response.close()
+            raise
+        except Exception as e:
+            self.providers.record_failure(provider, e)
+            raise
+        self.providers.record_success(provider, time.perf_counter() - started, stream)
+        return response, chunks
+
+    async def _arequest(self, stream: bool, params: dict):
+        """同 BaziAnalyzer._request，落败的请求以任务取消的方式关闭"""
+        import asyncio
+
+        candidates = self.providers.candidates(self.model)
+        first = self._next_candidate(candidates)
+        if not candidates:
+            return await self._aopen(first, stream, params)
+
+        pending = {}
+        last_error = None
+
+        def launch(provider, hedged: bool):
+            pending[asyncio.ensure_future(self._aopen(provider, stream, params))] = hedged
+            return provider
+
+        latest = launch(first, False)
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and candidates:
+                    timeout = self.providers.hedge_delay(latest, stream)
+                done, _ = await asyncio.wait(pending, timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    provider = self._next_candidate(candidates, required=False)
+                    if provider is not None:
+                        metrics.inc("bazi_hedge_total")
+                        latest = launch(provider, True)
+                    continue
+                for task in done:
+                    hedged = pending.pop(task)
+                    error = task.exception()
+                    if error is not None:
+                        if not is_provider_failure(error):
+                            raise error
+                        last_error = error
+                        continue
+                    if hedged:
+                        metrics.inc("bazi_hedge_wins_total")
+                    return task.result()
+                if not pending:
+                    provider = self._next_candidate(candidates, required=False)
+                    if provider is not None:
+                        metrics.inc("bazi_failover_total")
+                        latest = launch(provider, False)
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    def _retry_delay(self, error, attempt: int) -> float:
+        retry_after = error.response.headers.get("retry-after") if error.response else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.max_backoff)
+        except ValueError:
+            pass
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def analyze(self, report: dict) -> str:
+        result = await self.analyze_result(report)
+        return result["error"] or result["content"]
+
+    async def analyze_result(self, report: dict) -> dict:
+        """非流式分析，返回正文、推理内容、耗时（秒）与 token 用量
+
+        出错时 error 为错误信息；命中缓存时 cached 为 True，token 用量为0；
+        接口未返回 usage 时按字数估算，tokens_estimated 为 True。
+        """
+        import asyncio
+        from openai import APIConnectionError, APIError, RateLimitError
+
+        result = {"content": None, "reasoning": None, "error": None, "seconds": 0.0,
+                  "prompt_tokens": 0, "completion_tokens": 0, "cached": False,
+                  "tokens_estimated": False}
+        start = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(report)
+            # SQLite 读写放到线程中，不阻塞事件循环
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                result.update(content=cached, cached=True, seconds=time.perf_counter() - start)
+                return result
+
+        params = self._request_params(report)
+        for attempt in range(self.max_retries + 1):
+            try:
+                started = time.perf_counter()
+                response, _ = await self._arequest(False, params)
+                metrics.observe("bazi_llm_request_seconds", time.perf_counter() - started)
+                message = response.choices[0].message
+                result["content"] = message.content
+                result["reasoning"] = getattr(message, "reasoning_content", None)
+                if response.usage is not None:
+                    result["prompt_tokens"] = response.usage.prompt_tokens
+                    result["completion_tokens"] = response.usage.completion_tokens
+                else:
+                    from bazi_history import estimate_tokens
+
+                    result["prompt_tokens"] = sum(estimate_tokens(m["content"])
+                                                  for m in params["messages"])
+                    result["completion_tokens"] = estimate_tokens(
+                        (message.content or "") + (result["reasoning"] or ""))
+                    result["tokens_estimated"] = True
+                if key:
+                    await asyncio.to_thread(self.cache.put, key, message.content)
+                break
+            except RateLimitError as e:
+                if attempt == self.max_retries:
+                    result["error"] = "请求过于频繁，请稍后重试"
+                    break
+                await asyncio.sleep(self._retry_delay(e, attempt))
+            except APIConnectionError as e:
+                result["error"] = f"连接失败：{e.__cause__}"
+                break
+            except APIError as e:
+                result["error"] = f"API错误（{e.status_code}）：{e.message}"
+                break
+            except Exception as e:
+                result["error"] = f"未知错误：{str(e)}"
+                break
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    async def analyze_stream(self, report: dict, on_section=None):
+        """流式分析，异步逐块产出正文；出错时产出一条错误信息后结束
+
+        on_section(section) 在每个“🔹”分节完整到达时调用。
+        """
+        import asyncio
+        from openai import APIConnectionError, APIError, RateLimitError
+
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(report)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                processor = StreamProcessor(on_section)
+                for chunk in self._replay_stream(cached):
+                    processor.feed(chunk)
+                    yield chunk
+                processor.finish()
+                return
+
+        response = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                started = time.perf_counter()
+                response, chunks = await self._arequest(True, self._request_params(report))
+                break
+            except RateLimitError as e:
+                if attempt == self.max_retries:
+                    yield "请求过于频繁，请稍后重试"
+                    return
+                await asyncio.sleep(self._retry_delay(e, attempt))
+            except APIConnectionError as e:
+                yield f"连接失败：{e.__cause__}"
+                return
+            except APIError as e:
+                yield f"API错误（{e.status_code}）：{e.message}"
+                return
+            except Exception as e:
+                yield f"未知错误：{str(e)}"
+                return
+
+        processor = StreamProcessor(on_section)
+        timer = metrics.StreamTimer("bazi_llm", started)
+        try:
+            async for chunk in chunks:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                content = delta.content
+                reasoning = getattr(delta, "reasoning_content", None)
+                if content or reasoning:
+                    timer.chunk(content or reasoning)
+                    processor.feed(content, reasoning)
+                if content:
+                    yield content
+            timer.finish()
+        finally:
+            # 客户端断开等提前结束时也释放HTTP连接
+            await response.close()
+        result = processor.finish()
+        if key:
+            await asyncio.to_thread(self.cache.put, key, result.content)
+
+    async def analyze_many(self, reports, concurrency: int = None) -> list:
+        """并发分析多个命盘，结果顺序与输入一致"""
+        import asyncio
+
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def run(report):
+            async with semaphore:
+                return await self.analyze(report)
+
+        return await asyncio.gather(*(run(report) for report in reports))
@@ -0,0 +1,280 @@
+"""离线批量分析
+
+把大批出生记录排盘后放入磁盘上的任务队列（SQLite），相同命盘只分析一次，
+以有限并发调用 AsyncBaziAnalyzer。每完成一项即提交，进程中断后重新运行
+同一命令会跳过已完成的命盘，只补做剩余部分；失败项在下次运行时重试。
+结果以 JSONL 写出，每行一个命盘：
+    key          命盘与模型参数的哈希
+    ids          对应的输入记录（记录的 id 字段，缺省为行号）
+    report       命盘
+    content / reasoning / error
+    seconds      本次分析耗时
+    prompt_tokens / completion_tokens / tokens_estimated
+    attempts     尝试次数
+无法排盘的记录单独一行，只有 ids 与 error。
+
+输入记录同 bazi_cli（datetime、timezone、lunar、leap），也可以直接给出 report 字段。
+
+    python bazi_batch.py customers.jsonl -o analyses.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from bazi_cli import (_detect_format, chart_records, iter_chunks, read_records,
+                      row_to_record)
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class BatchQueue:
+    def __init__(self, path: str, model: str, prompt_version: int):
+        """path 为队列文件；其中的任务与模型、提示词版本绑定，不同时报错"""
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # run_queue 在线程中读写（不阻塞事件循环），由 _lock 串行化
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS items (
+                key TEXT PRIMARY KEY, report TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT, updated REAL);
+            CREATE INDEX IF NOT EXISTS items_status ON items(status);
+            CREATE TABLE IF NOT EXISTS members (
+                key TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (key, id));
+            CREATE TABLE IF NOT EXISTS rejected (id TEXT PRIMARY KEY, error TEXT NOT NULL);
+        """)
+        self._check_meta({"model": model, "prompt_version": str(prompt_version)})
+        self._db.commit()
+
+    def _check_meta(self, expected: dict):
+        stored = dict(self._db.execute("SELECT name, value FROM meta"))
+        for name, value in expected.items():
+            if name not in stored:
+                self._db.execute("INSERT INTO meta (name, value) VALUES (?, ?)", (name, value))
+            elif stored[name] != value:
+                raise ValueError(f"队列文件 {self.path} 的 {name} 为 {stored[name]}，"
+                                 f"与本次的 {value} 不一致，请换用新的队列文件")
+
+    def enqueue(self, items: list, rejected: list = ()):
+        """items 为 (key, 记录id, 命盘) 列表，已存在的命盘只追加记录id；整块一个事务"""
+        with self._db:
+            self._db.executemany("INSERT OR IGNORE INTO items (key, report) VALUES (?, ?)",
+                                 [(key, json.dumps(report, ensure_ascii=False))
+                                  for key, _, report in items])
+            self._db.executemany("INSERT OR IGNORE INTO members (key, id) VALUES (?, ?)",
+                                 [(key, item_id) for key, item_id, _ in items])
+            self._db.executemany("INSERT OR REPLACE INTO rejected (id, error) VALUES (?, ?)",
+                                 rejected)
+
+    def pending(self, max_attempts: int, page: int = 1000):
+        """逐页给出待处理与可重试的 (key, 命盘)"""
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute("""
+                    SELECT key, report FROM items
+                    WHERE key > ? AND (status = ? OR (status = ? AND attempts < ?))
+                    ORDER BY key LIMIT ?""", (last, PENDING, FAILED, max_attempts, page)).fetchall()
+            if not rows:
+                return
+            for key, report in rows:
+                yield key, json.loads(report)
+            last = rows[-1][0]
+
+    def finish(self, key: str, result: dict):
+        """记录一项结果并立即提交"""
+        status = FAILED if result.get("error") else DONE
+        with self._lock, self._db:
+            self._db.execute("""
+                UPDATE items SET status = ?, attempts = attempts + 1, result = ?, updated = ?
+                WHERE key = ?""", (status, json.dumps(result, ensure_ascii=False), time.time(), key))
+
+    def counts(self) -> dict:
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM items GROUP BY status"))
+        counts["rejected"] = self._db.execute("SELECT COUNT(*) FROM rejected").fetchone()[0]
+        return counts
+
+    def export(self, stream):
+        """按命盘写出全部已处理结果与无法排盘的记录，返回写出的行数"""
+        lines = 0
+        members = self._db.execute("SELECT key, id FROM members ORDER BY key, rowid")
+        member = next(members, None)
+        for key, report, attempts, result in self._db.execute("""
+                SELECT key, report, attempts, result FROM items
+                WHERE result IS NOT NULL ORDER BY key"""):
+            ids = []
+            while member is not None and member[0] <= key:
+                if member[0] == key:
+                    ids.append(member[1])
+                member = next(members, None)
+            line = {"key": key, "ids": ids, "report": json.loads(report),
+                    **json.loads(result), "attempts": attempts}
+            stream.write(json.dumps(line, ensure_ascii=False) + "\n")
+            lines += 1
+        for item_id, error in self._db.execute("SELECT id, error FROM rejected ORDER BY rowid"):
+            stream.write(json.dumps({"ids": [item_id], "error": error}, ensure_ascii=False) + "\n")
+            lines += 1
+        return lines
+
+    def close(self):
+        self._db.close()
+
+
+def enqueue_records(queue: BatchQueue, analyzer, records, default_timezone: str = "Asia/Shanghai",
+                    chunk_size: int = 10000) -> int:
+    """排盘并入队，返回读取的记录数；重复运行是幂等的"""
+    count = 0
+    for chunk in iter_chunks(records, chunk_size):
+        ids = [str(count + i + 1 if record.get("id") in (None, "") else record["id"])
+               for i, record in enumerate(chunk)]
+        count += len(chunk)
+        items, rejected, to_chart = [], [], []
+        for item_id, record in zip(ids, chunk):
+            report = record.get("report")
+            if isinstance(report, str):
+                try:
+                    report = json.loads(report)
+                except json.JSONDecodeError as e:
+                    rejected.append((item_id, f"report 字段JSON无效：{e.msg}"))
+                    continue
+            if report is not None:
+                items.append((analyzer._cache_key(report), item_id, report))
+            elif "error" in record:
+                rejected.append((item_id, record["error"]))
+            else:
+                to_chart.append((item_id, record))
+        if to_chart:
+            rows = chart_records([record for _, record in to_chart], default_timezone)
+            for (item_id, _), row in zip(to_chart, rows):
+                if "error" in row:
+                    rejected.append((item_id, row["error"]))
+                    continue
+                charted = row_to_record(row)
+                report = {"sizhu": charted["sizhu"], "wuxing": charted["wuxing"]}
+                items.append((analyzer._cache_key(report), item_id, report))
+        queue.enqueue(items, rejected)
+    return count
+
+
+async def run_queue(queue: BatchQueue, analyzer, concurrency: int = 8, max_attempts: int = 3,
+                    progress=None) -> dict:
+    """以 concurrency 个并发分析队列中的待处理项，每完成一项即提交
+
+    progress(done, failed) 在每项完成后调用。
+    """
+    stats = {"done": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    items = queue.pending(max_attempts)
+    claim = asyncio.Lock()
+    start = time.perf_counter()
+
+    async def next_item():
+        # 生成器不能在多个线程中同时推进，取项时加锁
+        async with claim:
+            return await asyncio.to_thread(next, items, None)
+
+    async def worker():
+        # 各协程共享同一个生成器，队列再大也只读出正在处理的几项；
+        # SQLite 读写都放到线程中，不阻塞其余协程
+        while True:
+            item = await next_item()
+            if item is None:
+                return
+            key, report = item
+            result = await analyzer.analyze_result(report)
+            await asyncio.to_thread(queue.finish, key, result)
+            stats["failed" if result["error"] else "done"] += 1
+            stats["prompt_tokens"] += result["prompt_tokens"]
+            stats["completion_tokens"] += result["completion_tokens"]
+            if progress is not None:
+                progress(stats["done"], stats["failed"])
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="离线批量八字分析（可中断续跑）")
+    parser.add_argument("input", nargs="?", default="-", help="输入文件，默认标准输入")
+    parser.add_argument("-o", "--output", required=True, help="结果 JSONL 文件")
+    parser.add_argument("--queue", help="任务队列文件，默认为输出文件名加 .queue.sqlite3")
+    parser.add_argument("--input-format", choices=["csv", "jsonl"])
+    parser.add_argument("--timezone", default="Asia/Shanghai", help="记录未指定时区时使用")
+    parser.add_argument("--api-key", help="分析接口密钥，默认读取环境变量 BAZI_API_KEY")
+    parser.add_argument("--model", default="deepseek-ai/DeepSeek-R1")
+    parser.add_argument("--base-url", help="分析接口地址")
+    parser.add_argument("--providers", help="多服务配置文件（见 bazi_providers）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-attempts", type=int, default=3, help="每个命盘最多尝试次数")
+    parser.add_argument("--skip-enqueue", action="store_true", help="不读取输入，只处理队列中剩余项")
+    return parser
+
+
+async def _run(args, queue: BatchQueue, analyzer) -> dict:
+    def progress(done: int, failed: int):
+        print(f"\r已完成 {done} 项，失败 {failed} 项", end="", file=sys.stderr, flush=True)
+
+    async with analyzer:
+        stats = await run_queue(queue, analyzer, args.concurrency, args.max_attempts,
+                                progress=progress)
+    print(file=sys.stderr)
+    return stats
+
+
+def main(argv=None):
+    from bazi_analysis import AsyncBaziAnalyzer
+
+    args = build_parser().parse_args(argv)
+    api_key = args.api_key or os.environ.get("BAZI_API_KEY")
+    if not api_key:
+        print("请通过 --api-key 或环境变量 BAZI_API_KEY 提供密钥", file=sys.stderr)
+        sys.exit(2)
+    providers = None
+    if args.providers:
+        from bazi_providers import ProviderRegistry
+        providers = ProviderRegistry.from_config(args.providers)
+    # 批量任务不急于首字，关闭对冲以免重复计费
+    analyzer = AsyncBaziAnalyzer(api_key, args.model, base_url=args.base_url,
+                                 concurrency=args.concurrency, providers=providers, hedge=False)
+    queue = BatchQueue(args.queue or args.output + ".queue.sqlite3", args.model,
+                       analyzer.PROMPT_VERSION)
+    try:
+        if not args.skip_enqueue:
+            fmt = _detect_format(args.input, args.input_format, "jsonl")
+            if args.input == "-":
+                source = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+            else:
+                source = open(args.input, encoding="utf-8", newline="")
+            with source:
+                read = enqueue_records(queue, analyzer, read_records(source, fmt), args.timezone)
+            print(f"已读取 {read} 条记录，队列状态：{queue.counts()}", file=sys.stderr)
+        stats = asyncio.run(_run(args, queue, analyzer))
+        # 结果以队列为准整体重写，中断时写了一半的输出不会残留
+        temp = args.output + ".tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            lines = queue.export(f)
+        os.replace(temp, args.output)
+    finally:
+        queue.close()
+
+    print(f"本次分析 {stats['done'] + stats['failed']} 项（失败 {stats['failed']} 项），"
+          f"耗时 {stats['seconds']:.1f} 秒，token {stats['prompt_tokens']}+"
+          f"{stats['completion_tokens']}；结果 {lines} 行写入 {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
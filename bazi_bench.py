@@ -0,0 +1,215 @@
+"""性能基准
+
+独立运行，结果输出为 JSON，可与保存的基线比较以发现性能回退：
+
+    python bazi_bench.py -o bench.json
+    python bazi_bench.py --baseline bench.json --threshold 0.2
+
+分析相关的基准连接本地桩服务（fake_openai_server），延迟可配置。
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import pytz
+
+from bazi_analysis import BaziAnalyzer
+from bazi_core import BaziCalculator, generate_batch
+from fake_openai_server import FakeOpenAIServer
+
+# 指标方向：时间越小越好，吞吐越大越好
+LOWER_IS_BETTER = "lower"
+HIGHER_IS_BETTER = "higher"
+
+SAMPLE_REPORT = {
+    "sizhu": {"year": "庚午", "month": "丁亥", "day": "辛亥", "hour": "壬辰"},
+    "wuxing": {"木": 0, "火": 1, "土": 0, "金": 2, "水": 1},
+}
+
+
+def _summarize(samples: list, unit: str, better: str = LOWER_IS_BETTER) -> dict:
+    return {
+        "unit": unit,
+        "better": better,
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "mean": statistics.fmean(samples),
+        "samples": len(samples),
+    }
+
+
+def _random_datetimes(count: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    start = datetime(1950, 1, 1, tzinfo=pytz.utc).timestamp()
+    end = datetime(2050, 1, 1, tzinfo=pytz.utc).timestamp()
+    return [datetime.fromtimestamp(rng.uniform(start, end), pytz.utc) for _ in range(count)]
+
+
+def bench_generate_report(repeat: int, records: int) -> dict:
+    """每条记录构造 BaziCalculator 并生成报告（冷缓存）"""
+    times = _random_datetimes(records)
+    samples = []
+    for _ in range(repeat):
+        BaziCalculator.pillar_cache.clear()
+        start = time.perf_counter()
+        for birth_time in times:
+            BaziCalculator(birth_time).generate_report()
+        samples.append((time.perf_counter() - start) / records)
+    return _summarize(samples, "s/record")
+
+
+def bench_generate_report_cached(repeat: int, records: int) -> dict:
+    """同一出生分钟重复排盘（命中进程级缓存）"""
+    birth_time = _random_datetimes(1)[0]
+    BaziCalculator(birth_time).generate_report()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(records):
+            BaziCalculator(birth_time).generate_report()
+        samples.append((time.perf_counter() - start) / records)
+    return _summarize(samples, "s/record")
+
+
+def bench_batch(repeat: int, records: int) -> dict:
+    """generate_batch 吞吐"""
+    rng = random.Random(7)
+    seconds = [rng.uniform(-631152000, 2524608000) for _ in range(records)]
+    generate_batch(seconds[:10])
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        generate_batch(seconds, "Asia/Shanghai")
+        samples.append(records / (time.perf_counter() - start))
+    return _summarize(samples, "records/s", HIGHER_IS_BETTER)
+
+
+def bench_solar_term(repeat: int, records: int) -> dict:
+    """_get_solar_term_date 单次查询"""
+    calculator = BaziCalculator(_random_datetimes(1)[0])
+    rng = random.Random(3)
+    queries = [(rng.randint(1900, 2100), rng.choice(BaziCalculator.SOLAR_TERMS))
+               for _ in range(records)]
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for year, term in queries:
+            calculator._get_solar_term_date(year, term)
+        samples.append((time.perf_counter() - start) / records)
+    return _summarize(samples, "s/call")
+
+
+def bench_build_messages(repeat: int, records: int) -> dict:
+    analyzer = BaziAnalyzer("sk-bench", base_url="http://127.0.0.1:9/v1")
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(records):
+            analyzer._build_messages(SAMPLE_REPORT)
+        samples.append((time.perf_counter() - start) / records)
+    return _summarize(samples, "s/call")
+
+
+def bench_analyze(repeat: int, latency: float, chunk_delay: float) -> dict:
+    """对本地桩服务的完整分析往返：非流式总耗时、流式首块耗时与总耗时"""
+    results = {}
+    with FakeOpenAIServer(latency=latency, chunk_delay=chunk_delay) as server:
+        analyzer = BaziAnalyzer("sk-bench", base_url=server.base_url)
+        analyzer.analyze(SAMPLE_REPORT)  # 预热连接
+
+        total = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            analyzer.analyze(SAMPLE_REPORT)
+            total.append(time.perf_counter() - start)
+        results["analyze_total"] = _summarize(total, "s")
+
+        first_chunk, stream_total = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            first = None
+            for _ in analyzer.analyze(SAMPLE_REPORT, stream=True):
+                if first is None:
+                    first = time.perf_counter() - start
+            stream_total.append(time.perf_counter() - start)
+            first_chunk.append(first)
+        results["analyze_stream_first_chunk"] = _summarize(first_chunk, "s")
+        results["analyze_stream_total"] = _summarize(stream_total, "s")
+    return results
+
+
+def run_all(args) -> dict:
+    results = {
+        "generate_report": bench_generate_report(args.repeat, args.records),
+        "generate_report_cached": bench_generate_report_cached(args.repeat, args.records),
+        "batch_throughput": bench_batch(args.repeat, args.batch_records),
+        "solar_term_lookup": bench_solar_term(args.repeat, args.records),
+        "build_messages": bench_build_messages(args.repeat, args.records),
+    }
+    if not args.skip_analyze:
+        results.update(bench_analyze(args.analyze_repeat, args.latency, args.chunk_delay))
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """返回超过阈值的回退项 (名称, 基线中位数, 当前中位数, 变化比例)"""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base["median"]:
+            continue
+        change = (result["median"] - base["median"]) / base["median"]
+        if result["better"] == HIGHER_IS_BETTER:
+            change = -change
+        if change > threshold:
+            regressions.append((name, base["median"], result["median"], change))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="八字排盘与分析性能基准")
+    parser.add_argument("-o", "--output", help="结果写入JSON文件")
+    parser.add_argument("--baseline", help="与之比较的基线JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的回退比例")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--batch-records", type=int, default=200000)
+    parser.add_argument("--analyze-repeat", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="桩服务首字节延迟（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="桩服务流式分块间隔（秒）")
+    parser.add_argument("--skip-analyze", action="store_true", help="跳过分析往返基准")
+    args = parser.parse_args(argv)
+
+    report = run_all(args)
+    for name, result in report["results"].items():
+        print(f"{name:30s} {result['median']:.6g} {result['unit']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print(f"性能回退：{name} {before:.6g} -> {after:.6g}（{change:+.0%}）", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""分析结果缓存
+
+内存 LRU 在前、SQLite 在后的两级缓存。键为命盘报告、模型、采样参数
+与提示词模板版本的规范化 JSON 的 SHA-256，相同命盘的分析不再重复请求远端模型。
+内存命中的访问时间攒批写回磁盘，使按访问时间淘汰时不会先删去最常用的条目。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".bazi", "analysis_cache.sqlite3")
+TOUCH_BATCH = 64    # 内存命中的访问时间攒够此数即写回
+
+
+def cache_key(report: dict, model: str, temperature: float, top_p: float,
+              prompt_version: int, max_tokens: int = None) -> str:
+    payload = {
+        "report": report,
+        "model": model,
+        "temperature": temperature,
+        "top_p": top_p,
+        "max_tokens": max_tokens,
+        "prompt_version": prompt_version,
+    }
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = DEFAULT_PATH, memory_size: int = 256,
+                 max_entries: int = 10000, ttl: float = 30 * 86400):
+        """ttl 为秒数，None 表示永不过期；max_entries 限制磁盘条目数"""
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._touched = {}      # 内存命中、尚未写回的访问时间
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, value TEXT NOT NULL,
+            created REAL NOT NULL, accessed REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._db.commit()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1], now):
+                self._memory.move_to_end(key)
+                self._touched[key] = now
+                if len(self._touched) >= TOUCH_BATCH:
+                    self._flush_touched()
+                    self._db.commit()
+                self.hits += 1
+                return entry[0]
+            row = self._db.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """value 为 None 或空串（如只有工具调用的回答）时不缓存"""
+        if not value:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now))
+            self._flush_touched()
+            self._evict(now)
+            self._db.commit()
+            self._remember(key, value, now)
+
+    def _remember(self, key: str, value: str, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            self._db.execute("""DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)""",
+                             (self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._db.commit()
+            self._db.close()
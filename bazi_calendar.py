@@ -0,0 +1,158 @@
+"""逐日历表
+
+与节气表同范围（1799-2201年）的每一天一条8字节记录，顺序存放在 day_calendar.bin：
+    ganzhi       日干支的六十甲子序号（甲子为0），按当地日期，与时区无关
+    month        当日零点（北京时间）所在节气月的月柱序号，节气表之外为 NONE
+    term         当日（北京时间）交入的节气下标（0 为小寒），无则为 NONE
+    lunar_month  农历月（1-12），农历表（1900-2100年）之外为0
+    lunar_day    农历日（1-30）
+    leap         是否闰月
+    lunar_year   农历年
+文件以内存映射读取，按日查询只需一次下标访问；多个进程映射同一文件时共享页缓存。
+单条查询用标准库 mmap，不必加载 numpy；批量查询用 numpy.memmap。
+文件随代码发布；缺失或大小不符时在内存中现场生成（需要 numpy），运行时不写文件。
+重新生成：python bazi_calendar.py
+"""
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from datetime import date
+
+import solar_terms
+
+FIRST_DATE = date(solar_terms.FIRST_YEAR, 1, 1)
+LAST_DATE = date(solar_terms.LAST_YEAR, 12, 31)
+DAYS = LAST_DATE.toordinal() - FIRST_DATE.toordinal() + 1
+CALENDAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "day_calendar.bin")
+NONE = 0xFF
+FIELDS = ("ganzhi", "month", "term", "lunar_month", "lunar_day", "leap", "lunar_year")
+RECORD = struct.Struct("<BBBBBBh")
+
+_UNIX_ORDINAL = date(1970, 1, 1).toordinal()
+_FIRST_ORDINAL = FIRST_DATE.toordinal()
+_FIRST_DAY = _FIRST_ORDINAL - _UNIX_ORDINAL   # 1970-01-01 起的日数
+JIAZI_DAY = date(2000, 1, 7).toordinal() - _UNIX_ORDINAL  # 2000年1月7日为甲子日
+_BEIJING = 8 * 3600
+
+CalendarDay = namedtuple("CalendarDay", FIELDS)
+
+_lock = threading.Lock()
+_buffer = None
+_array = None
+
+
+def _dtype():
+    import numpy as np
+
+    return np.dtype([("ganzhi", "u1"), ("month", "u1"), ("term", "u1"), ("lunar_month", "u1"),
+                     ("lunar_day", "u1"), ("leap", "u1"), ("lunar_year", "<i2")])
+
+
+def generate():
+    """计算全部记录，返回结构化 numpy 数组"""
+    import numpy as np
+    import bazi_lunar
+
+    days = np.arange(_FIRST_DAY, _FIRST_DAY + DAYS, dtype=np.int64)
+    table = np.zeros(DAYS, dtype=_dtype())
+    table["ganzhi"] = (days - JIAZI_DAY) % 60
+
+    # 节气月：北京时间零点所在的“节”区间，年柱以立春为界（与 BaziCalculator 相同）
+    terms = np.frombuffer(solar_terms.load_table(), dtype=np.int64)
+    midnight = days * 86400 - _BEIJING
+    index = np.searchsorted(terms, midnight, side="right") - 1
+    known = index >= 0
+    term = index % 24
+    year = solar_terms.FIRST_YEAR + index // 24 - (term < 2)
+    month_zhi = (term // 2 + 1) % 12
+    month_gan = ((year - 4) % 10 % 5 * 2 + 2 + (month_zhi - 2) % 12) % 10
+    table["month"] = np.where(known, (6 * month_gan - 5 * month_zhi) % 60, NONE)
+    following = np.searchsorted(terms, midnight + 86400, side="right") - 1
+    table["term"] = np.where(following > index, following % 24, NONE)
+
+    # 农历日期（仅农历表范围内）
+    ordinals = days + _UNIX_ORDINAL
+    lunar_first = bazi_lunar.to_solar_ordinal(bazi_lunar.FIRST_YEAR, 1, 1)
+    lunar_end = bazi_lunar.to_solar_ordinal(bazi_lunar.LAST_YEAR, 12,
+                                            bazi_lunar.month_days(bazi_lunar.LAST_YEAR, 12))
+    inside = (ordinals >= lunar_first) & (ordinals <= lunar_end)
+    lunar = bazi_lunar.from_solar_array(days[inside].astype("datetime64[D]"))
+    table["lunar_year"][inside] = lunar["year"]
+    table["lunar_month"][inside] = lunar["month"]
+    table["lunar_day"][inside] = lunar["day"]
+    table["leap"][inside] = lunar["leap"]
+    return table
+
+
+def save(path: str = CALENDAR_PATH):
+    """生成并写入文件（先写临时文件再替换）"""
+    temp = path + ".tmp"
+    generate().tofile(temp)
+    os.replace(temp, path)
+
+
+def _load_buffer():
+    """只读映射日历文件；文件缺失或大小不符时在内存中生成（与节气表相同，不写回）"""
+    global _buffer
+    with _lock:
+        if _buffer is not None:
+            return _buffer
+        try:
+            with open(CALENDAR_PATH, "rb") as f:
+                if os.fstat(f.fileno()).st_size == DAYS * RECORD.size:
+                    _buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    return _buffer
+        except OSError:
+            pass
+        _buffer = generate().tobytes()
+        return _buffer
+
+
+def load():
+    """整表的 numpy.memmap（结构化数组，字段见 FIELDS）"""
+    global _array
+    if _array is None:
+        import numpy as np
+
+        buffer = _load_buffer()
+        if isinstance(buffer, bytes):
+            _array = np.frombuffer(buffer, dtype=_dtype())
+        else:
+            _array = np.memmap(CALENDAR_PATH, dtype=_dtype(), mode="r", shape=(DAYS,))
+    return _array
+
+
+def _offset(ordinal: int) -> int:
+    index = ordinal - _FIRST_ORDINAL
+    if not 0 <= index < DAYS:
+        raise ValueError(f"超出日历表范围（{FIRST_DATE.year}-{LAST_DATE.year}年）")
+    return index * RECORD.size
+
+
+def lookup(day: date) -> CalendarDay:
+    """某个公历日期的记录"""
+    buffer = _buffer if _buffer is not None else _load_buffer()
+    return CalendarDay._make(RECORD.unpack_from(buffer, _offset(day.toordinal())))
+
+
+def day_ganzhi(ordinal: int) -> int:
+    """公历日序号（date.toordinal）对应的日干支序号"""
+    buffer = _buffer if _buffer is not None else _load_buffer()
+    return buffer[_offset(ordinal)]
+
+
+def day_ganzhi_array(days):
+    """批量查询日干支序号，days 为自1970-01-01起的当地日数"""
+    import numpy as np
+
+    index = np.asarray(days, dtype=np.int64) - _FIRST_DAY
+    if index.size and (index.min() < 0 or index.max() >= DAYS):
+        raise ValueError(f"超出日历表范围（{FIRST_DATE.year}-{LAST_DATE.year}年）")
+    return load()["ganzhi"][index]
+
+
+if __name__ == "__main__":
+    save()
+    print(f"已生成 {CALENDAR_PATH}：{FIRST_DATE} 至 {LAST_DATE}，共 {DAYS} 天")
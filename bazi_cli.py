@@ -0,0 +1,293 @@
+"""命令行批量排盘
+
+从 CSV 或 JSONL（文件或标准输入）读取出生记录，分块排盘后流式写出，
+内存占用只与块大小有关。每条记录字段：
+    datetime  出生时间（ISO格式，不带时区时按 timezone 解释）
+    timezone  时区（可选，默认 --timezone）
+    lunar     是否为农历日期（可选，1/true/yes/农历）
+    leap      农历日期是否在闰月（可选，1/true/yes/闰）
+
+示例：
+    python bazi_cli.py births.csv -o charts.jsonl
+    cat births.jsonl | python bazi_cli.py --input-format jsonl --output-format csv
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+from bazi_core import (ELEMENTS, PILLARS, BaziCalculator, _get_timezone,
+                       generate_batch, localize_batch)
+import bazi_lunar
+import solar_terms
+
+OUTPUT_FIELDS = ["datetime", "timezone", *PILLARS, *ELEMENTS, "error"]
+_GANZHI = [[gan + zhi for zhi in BaziCalculator.DIZHI] for gan in BaziCalculator.TIANGAN]
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+_TRUE_VALUES = {"1", "true", "yes", "y", "农历", "闰"}
+_DATE_PREFIX = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+
+
+def read_records(stream, fmt: str):
+    """逐条读取输入记录"""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"error": f"第{line_no}行JSON无效：{e.msg}"}
+
+
+def _is_lunar(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in _TRUE_VALUES
+
+
+def parse_record(record: dict, default_timezone: str) -> tuple:
+    """解析一条记录，返回 (秒数, 是否为当地时间, 时区)
+
+    不带时区的出生时间返回按UTC计的当地秒数，由调用方批量换算。
+    """
+    if record.get("error"):
+        raise ValueError(record["error"])
+    timezone = (record.get("timezone") or default_timezone).strip()
+    try:
+        _get_timezone(timezone)
+    except KeyError:
+        raise ValueError(f"未知时区：{timezone}")
+    try:
+        text = str(record["datetime"]).strip()
+    except KeyError:
+        raise ValueError("缺少 datetime 字段")
+    if _is_lunar(record.get("lunar")):
+        # 农历二月可有三十日，须先换成公历日期再按 ISO 格式解析时间部分
+        match = _DATE_PREFIX.match(text)
+        if match is None:
+            raise ValueError(f"农历日期格式应为 YYYY-MM-DD：{text}")
+        year, month, day = map(int, match.groups())
+        solar = bazi_lunar.to_solar(year, month, day, _is_lunar(record.get("leap")))
+        text = solar.isoformat() + text[match.end():]
+    birth_time = datetime.fromisoformat(text)
+    if birth_time.tzinfo is None:
+        return (birth_time - _NAIVE_EPOCH).total_seconds(), True, timezone
+    return birth_time.timestamp(), False, timezone
+
+
+def chart_records(records: list, default_timezone: str = "Asia/Shanghai") -> list:
+    """对一块记录排盘，无效记录带 error 字段输出而不中断整块"""
+    rows, charted, batch = encode_records(records, default_timezone)
+    if batch is None:
+        return rows
+    stems, branches = batch["stem"].tolist(), batch["branch"].tolist()
+    wuxing = batch["wuxing"].tolist()
+    for i, row in enumerate(charted):
+        for column, pillar in enumerate(PILLARS):
+            row[pillar] = _GANZHI[stems[i][column]][branches[i][column]]
+        row.update(zip(ELEMENTS, wuxing[i]))
+    return rows
+
+
+def encode_records(records: list, default_timezone: str = "Asia/Shanghai") -> tuple:
+    """对一块记录排盘，返回 (输出行, 排盘成功的行, generate_batch 结果)
+
+    排盘成功的行与结果逐行对应；整块都无效时结果为 None。
+    """
+    import numpy as np
+
+    rows = [{"datetime": r.get("datetime"), "timezone": r.get("timezone") or default_timezone}
+            for r in records]
+    valid, parsed = [], []
+    for row, record in zip(rows, records):
+        try:
+            parsed.append(parse_record(record, default_timezone))
+        except Exception as e:
+            row["error"] = str(e)
+            continue
+        valid.append(row)
+    if not valid:
+        return rows, [], None
+
+    seconds = np.array([p[0] for p in parsed], dtype=np.float64)
+    is_local = np.array([p[1] for p in parsed], dtype=bool)
+    timezones = np.array([p[2] for p in parsed])
+    for name in np.unique(timezones[is_local]):
+        mask = is_local & (timezones == name)
+        seconds[mask] = localize_batch(seconds[mask], str(name))
+
+    table = solar_terms.load_table()
+    in_range = (seconds >= table[0]) & (seconds < table[-1])
+    for i in np.flatnonzero(~in_range):
+        valid[i]["error"] = f"超出节气表范围（{solar_terms.FIRST_YEAR}-{solar_terms.LAST_YEAR}年）"
+    if not in_range.any():
+        return rows, [], None
+
+    charted = [row for row, ok in zip(valid, in_range) if ok]
+    return rows, charted, generate_batch(seconds[in_range], timezones[in_range])
+
+
+def row_to_record(row: dict) -> dict:
+    """把 chart_records 的输出行整理为与 generate_report 同构的嵌套结构"""
+    if "error" in row:
+        return row
+    return {
+        "datetime": row["datetime"],
+        "timezone": row["timezone"],
+        "sizhu": {p: row[p] for p in PILLARS},
+        "wuxing": {e: row[e] for e in ELEMENTS},
+    }
+
+
+class JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, rows: list):
+        for row in rows:
+            self.stream.write(json.dumps(row_to_record(row), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.stream.flush()
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=OUTPUT_FIELDS)
+        self.writer.writeheader()
+
+    def write(self, rows: list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.stream.flush()
+
+
+class ParquetWriter:
+    """列式输出，每块写一个 row group（需要 pyarrow）"""
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("输出 parquet 需要安装 pyarrow")
+        self.pa = pa
+        fields = [pa.field(name, pa.string()) for name in ["datetime", "timezone", *PILLARS]]
+        fields += [pa.field(name, pa.int8()) for name in ELEMENTS]
+        fields.append(pa.field("error", pa.string()))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows: list):
+        columns = {name: [row.get(name) for row in rows] for name in self.schema.names}
+        columns["datetime"] = [None if v is None else str(v) for v in columns["datetime"]]
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _detect_format(path: str, explicit: str, default: str) -> str:
+    if explicit:
+        return explicit
+    if path and path != "-":
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        if ext in ("csv", "jsonl", "parquet"):
+            return ext
+        if ext in ("json", "ndjson"):
+            return "jsonl"
+    return default
+
+
+def _open_writer(path: str, fmt: str):
+    if fmt == "parquet":
+        if not path or path == "-":
+            raise SystemExit("parquet 输出需要用 -o 指定文件")
+        return ParquetWriter(path), None
+    if not path or path == "-":
+        stream, owned = sys.stdout, None
+    else:
+        stream = owned = open(path, "w", encoding="utf-8", newline="")
+    writer = CsvWriter(stream) if fmt == "csv" else JsonlWriter(stream)
+    return writer, owned
+
+
+def iter_chunks(records, chunk_size: int):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run(records, writer, chunk_size: int, default_timezone: str, workers: int = 1) -> dict:
+    """逐块排盘并写出，返回处理统计"""
+    stats = {"records": 0, "errors": 0}
+    start = time.perf_counter()
+    if workers > 1:
+        from bazi_parallel import ParallelCharter
+        results = ParallelCharter(workers, chunk_size,
+                                  default_timezone=default_timezone).map(records)
+    else:
+        results = (chart_records(chunk, default_timezone)
+                   for chunk in iter_chunks(records, chunk_size))
+    for rows in results:
+        writer.write(rows)
+        stats["records"] += len(rows)
+        stats["errors"] += sum(1 for row in rows if "error" in row)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="批量八字排盘")
+    parser.add_argument("input", nargs="?", default="-", help="输入文件，默认标准输入")
+    parser.add_argument("-o", "--output", default="-", help="输出文件，默认标准输出")
+    parser.add_argument("--input-format", choices=["csv", "jsonl"])
+    parser.add_argument("--output-format", choices=["jsonl", "csv", "parquet"])
+    parser.add_argument("--timezone", default="Asia/Shanghai", help="记录未指定时区时使用")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=1, help="工作进程数，大于1时多进程并行")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    in_fmt = _detect_format(args.input, args.input_format, "jsonl")
+    out_fmt = _detect_format(args.output, args.output_format, "jsonl")
+
+    if args.input == "-":
+        source = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    else:
+        source = open(args.input, encoding="utf-8", newline="")
+    writer, owned = _open_writer(args.output, out_fmt)
+    try:
+        stats = run(read_records(source, in_fmt), writer, args.chunk_size, args.timezone,
+                    args.workers)
+    finally:
+        writer.close()
+        if owned:
+            owned.close()
+        if args.input != "-":
+            source.close()
+
+    rate = stats["records"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"已处理 {stats['records']} 条记录（失败 {stats['errors']} 条），"
+          f"耗时 {stats['seconds']:.2f} 秒，{rate:,.0f} 条/秒", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
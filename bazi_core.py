@@ -1,76 +1,156 @@
-from datetime import datetime
-import pytz
-from dateutil import tz
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone as _timezone
+from functools import lru_cache
+import struct
+import threading
+import bazi_calendar
+import bazi_metrics as metrics
+import solar_terms
+
+PILLARS = ("year", "month", "day", "hour")
+ELEMENTS = ("木", "火", "土", "金", "水")
+_UTC = _timezone.utc
+_EPOCH = datetime(1970, 1, 1, tzinfo=_UTC)
+_DAY_BASE = bazi_calendar.JIAZI_DAY * 86400.0  # 甲子日零点，按当地时间计的秒数
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+@lru_cache(maxsize=None)
+def _get_timezone(name: str):
+    import pytz  # 首次用到时区时才加载
+
+    return pytz.timezone(name)
+
+
+class PillarCache:
+    """进程级四柱缓存，键为 (UTC分钟, 时区)，按LRU淘汰"""
+
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
 
 class BaziCalculator:
     TIANGAN = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸"]
     DIZHI = ["子", "丑", "寅", "卯", "辰", "巳", "午", "未", "申", "酉", "戌", "亥"]
-    SOLAR_TERMS = {  # 简化版节气数据（需补充完整）
-        2023: [("立春", datetime(2023, 2, 4)), ("雨水", datetime(2023, 2, 19))],
-        1990: [("立春", datetime(1990, 2, 4))]
+    SOLAR_TERMS = solar_terms.TERM_NAMES
+    ELEMENT_MAP = {
+        "甲": "木", "乙": "木", "寅": "木", "卯": "木",
+        "丙": "火", "丁": "火", "巳": "火", "午": "火",
+        "戊": "土", "己": "土", "辰": "土", "戌": "土", "丑": "土", "未": "土",
+        "庚": "金", "辛": "金", "申": "金", "酉": "金",
+        "壬": "水", "癸": "水", "亥": "水", "子": "水"
     }
+    pillar_cache = PillarCache()
 
     def __init__(self, birth_datetime: datetime, timezone: str = 'Asia/Shanghai'):
-        self.birth_time = birth_datetime.astimezone(pytz.timezone(timezone))
+        self.birth_time = birth_datetime.astimezone(_get_timezone(timezone))
         self.timezone = timezone
+        # 四柱按分钟精度计算，同一分钟内的出生时间共享缓存结果
+        self._utc_minute = int((self.birth_time - _EPOCH).total_seconds() // 60)
+        self._pillars = None
+
+    def _get_pillars(self) -> tuple:
+        """四柱的 (天干下标, 地支下标)，每个实例只计算一次"""
+        if self._pillars is None:
+            key = (self._utc_minute, self.timezone)
+            pillars = self.pillar_cache.get(key)
+            if pillars is None:
+                with metrics.span("bazi_pillar_compute_seconds"):
+                    pillars = self._compute_pillars()
+                self.pillar_cache.put(key, pillars)
+            self._pillars = pillars
+        return self._pillars
+
+    def _compute_pillars(self) -> tuple:
+        seconds = self._utc_minute * 60
+
+        # 年柱（小寒、大寒仍属上一年）
+        index = solar_terms.locate(seconds)
+        term = index % 24
+        year = solar_terms.FIRST_YEAR + index // 24 - (term < 2)
+        year_pillar = ((year - 4) % 10, (year - 4) % 12)
+
+        # 月柱（五虎遁：由年干推出寅月天干）
+        month_zhi = (term // 2 + 1) % 12
+        month_pillar = ((year_pillar[0] % 5 * 2 + 2 + (month_zhi - 2) % 12) % 10, month_zhi)
+
+        # 日柱（按当地日期查日历表）
+        day_index = bazi_calendar.day_ganzhi(self.birth_time.toordinal())
+        day_pillar = (day_index % 10, day_index % 12)
+
+        # 时柱
+        hour_zhi = (self.birth_time.hour + 1) // 2 % 12
+        hour_pillar = ((day_pillar[0] % 5 * 2 + hour_zhi) % 10, hour_zhi)
+
+        return year_pillar, month_pillar, day_pillar, hour_pillar
+
+    def _format_pillar(self, position: int) -> str:
+        gan_index, zhi_index = self._get_pillars()[position]
+        return self.TIANGAN[gan_index] + self.DIZHI[zhi_index]
 
     def _get_year_ganzhi(self) -> str:
         """计算年柱（考虑立春）"""
-        year = self.birth_time.year
-        # 检查是否在立春前
-        if self.birth_time < self._get_solar_term_date(year, "立春"):
-            year -= 1
-        return self.TIANGAN[(year - 4) % 10] + self.DIZHI[(year - 4) % 12]
+        return self._format_pillar(0)
 
     def _get_month_ganzhi(self) -> str:
         """计算月柱（基于节气）"""
-        month_stems = [2, 4, 6, 8, 0, 2, 4, 6, 8, 0, 2, 4]
-        year_gan = self.TIANGAN.index(self._get_year_ganzhi()[0])
-        month_index = (year_gan % 5) * 2 + (self.birth_time.month + 1) // 2
-        return self.TIANGAN[month_stems[month_index % 12]] + self.DIZHI[(self.birth_time.month + 1) % 12]
+        return self._format_pillar(1)
 
     def _get_day_ganzhi(self) -> str:
-        """计算日柱（基准日法）"""
-        base_date = datetime(2020, 12, 27, tzinfo=pytz.utc)  # 基准日：庚子日
-        delta = self.birth_time - base_date
-        days = delta.days
-        ganzhi_index = days % 60
-        return self.TIANGAN[ganzhi_index % 10] + self.DIZHI[ganzhi_index % 12]
+        """计算日柱（按当地日期）"""
+        return self._format_pillar(2)
 
     def _get_hour_ganzhi(self) -> str:
         """计算时柱"""
-        day_gan = self.TIANGAN.index(self._get_day_ganzhi()[0])
-        hour = self.birth_time.hour
-        zhi_index = (hour + 1) // 2 % 12
-        gan_index = (day_gan % 5 * 2 + zhi_index) % 10
-        return self.TIANGAN[gan_index] + self.DIZHI[zhi_index]
+        return self._format_pillar(3)
 
     def _get_solar_term_date(self, year: int, term: str) -> datetime:
-        """获取指定年份节气时间（示例数据）"""
-        for t, dt in self.SOLAR_TERMS.get(year, []):
-            if t == term:
-                return dt.replace(tzinfo=pytz.UTC).astimezone(pytz.timezone(self.timezone))
-        return datetime(year, 1, 1, tzinfo=pytz.timezone(self.timezone))
+        """获取指定年份节气时间"""
+        seconds = solar_terms.term_time(year, term)
+        return datetime.fromtimestamp(seconds, _get_timezone(self.timezone))
 
     def get_wuxing_strength(self) -> dict:
         """五行强度计算（简化版）"""
-        elements = {"木": 0, "火": 0, "土": 0, "金": 0, "水": 0}
-        for ganzhi in [self._get_year_ganzhi(), self._get_month_ganzhi(),
-                       self._get_day_ganzhi(), self._get_hour_ganzhi()]:
-            element = self._get_element(ganzhi)
-            elements[element] += 1
+        elements = dict.fromkeys(ELEMENTS, 0)
+        for gan_index, _ in self._get_pillars():
+            # 天干下标整除2即为 ELEMENTS 下标
+            elements[ELEMENTS[gan_index // 2]] += 1
         return elements
 
     def _get_element(self, ganzhi: str) -> str:
         """天干地支对应的五行"""
-        element_map = {
-            "甲": "木", "乙": "木", "寅": "木", "卯": "木",
-            "丙": "火", "丁": "火", "巳": "火", "午": "火",
-            "戊": "土", "己": "土", "辰": "土", "戌": "土", "丑": "土", "未": "土",
-            "庚": "金", "辛": "金", "申": "金", "酉": "金",
-            "壬": "水", "癸": "水", "亥": "水", "子": "水"
-        }
-        return element_map.get(ganzhi[0], "土")
+        return self.ELEMENT_MAP.get(ganzhi[0], "土")
 
     def generate_report(self) -> dict:
         return {
@@ -83,6 +163,240 @@ class BaziCalculator:
             "wuxing": self.get_wuxing_strength()
         }
 
+    def to_chart(self) -> "Chart":
+        return Chart([gan for gan, _ in self._get_pillars()],
+                     [zhi for _, zhi in self._get_pillars()])
+
+
+class Chart:
+    """紧凑命盘：四柱与五行计数打包为一个8字节整数
+
+    字节0-3依次为年月日时柱（高4位天干、低4位地支），
+    字节4-5为五行计数（每项3位，顺序见 ELEMENTS），字节6-7保留。
+    """
+    __slots__ = ("_code",)
+    STRUCT = struct.Struct("<4BH2x")
+    size = STRUCT.size
+
+    def __init__(self, stems, branches, wuxing=None):
+        if wuxing is None:
+            wuxing = [0] * len(ELEMENTS)
+            for gan_index in stems:
+                wuxing[gan_index // 2] += 1
+        if not (len(stems) == len(branches) == 4 and len(wuxing) == len(ELEMENTS)):
+            raise ValueError("命盘需包含四柱与五行计数")
+        if not all(0 <= g < 10 for g in stems) or not all(0 <= z < 12 for z in branches):
+            raise ValueError("天干或地支下标越界")
+        if not all(0 <= count < 8 for count in wuxing):
+            raise ValueError("五行计数超出范围")
+        counts = 0
+        for position, count in enumerate(wuxing):
+            counts |= count << (3 * position)
+        data = self.STRUCT.pack(*((g << 4) | z for g, z in zip(stems, branches)), counts)
+        self._code = int.from_bytes(data, "little")
+
+    @classmethod
+    def _from_code(cls, code: int) -> "Chart":
+        chart = object.__new__(cls)
+        chart._code = code
+        return chart
+
+    @property
+    def stems(self) -> tuple:
+        return tuple((self._code >> (8 * i + 4)) & 0xF for i in range(4))
+
+    @property
+    def branches(self) -> tuple:
+        return tuple((self._code >> (8 * i)) & 0xF for i in range(4))
+
+    @property
+    def wuxing(self) -> tuple:
+        counts = (self._code >> 32) & 0xFFFF
+        return tuple((counts >> (3 * i)) & 0x7 for i in range(len(ELEMENTS)))
+
+    @classmethod
+    def from_report(cls, report: dict) -> "Chart":
+        try:
+            sizhu = report["sizhu"]
+            stems = [BaziCalculator.TIANGAN.index(sizhu[p][0]) for p in PILLARS]
+            branches = [BaziCalculator.DIZHI.index(sizhu[p][1]) for p in PILLARS]
+            wuxing = [report["wuxing"][e] for e in ELEMENTS]
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"无效的命盘报告：{e}")
+        return cls(stems, branches, wuxing)
+
+    def to_report(self) -> dict:
+        return {
+            "sizhu": {
+                p: BaziCalculator.TIANGAN[g] + BaziCalculator.DIZHI[z]
+                for p, g, z in zip(PILLARS, self.stems, self.branches)
+            },
+            "wuxing": dict(zip(ELEMENTS, self.wuxing))
+        }
+
+    def to_bytes(self) -> bytes:
+        return self._code.to_bytes(self.size, "little")
+
+    @classmethod
+    def from_bytes(cls, buffer, offset: int = 0) -> "Chart":
+        """从 bytes/bytearray/memoryview 的 offset 处解包，不复制缓冲区"""
+        view = memoryview(buffer)[offset:offset + cls.size]
+        return cls._from_code(int.from_bytes(view, "little"))
+
+    def pack_into(self, buffer, offset: int = 0):
+        memoryview(buffer)[offset:offset + self.size] = self.to_bytes()
+
+    @classmethod
+    def pack_many(cls, charts) -> bytearray:
+        buffer = bytearray()
+        for chart in charts:
+            buffer += chart.to_bytes()
+        return buffer
+
+    @classmethod
+    def iter_unpack(cls, buffer):
+        """逐个解包连续存放的命盘"""
+        view = memoryview(buffer).cast("B")
+        if len(view) % cls.size:
+            raise ValueError("缓冲区长度不是命盘大小的整数倍")
+        for offset in range(0, len(view), cls.size):
+            yield cls._from_code(int.from_bytes(view[offset:offset + cls.size], "little"))
+
+    def __eq__(self, other):
+        return isinstance(other, Chart) and self._code == other._code
+
+    def __hash__(self):
+        return hash(self._code)
+
+    def __repr__(self):
+        sizhu = self.to_report()["sizhu"]
+        return f"Chart({' '.join(sizhu[p] for p in PILLARS)})"
+
+
+@lru_cache(maxsize=None)
+def _transition_table(timezone: str):
+    import numpy as np
+
+    tzinfo = _get_timezone(timezone)
+    transitions = getattr(tzinfo, "_utc_transition_times", None)
+    if not transitions:
+        offset = datetime(2000, 1, 1, tzinfo=_UTC).astimezone(tzinfo).utcoffset()
+        return np.empty(0), np.array([offset.total_seconds()], dtype=np.int64)
+    # 首个转换点为 datetime.min 的占位，跳过后 searchsorted 的结果即为规则下标
+    edges = np.array([(t.replace(tzinfo=_UTC) - _EPOCH).total_seconds()
+                      for t in transitions[1:]], dtype=np.float64)
+    offsets = np.array([info[0].total_seconds() for info in tzinfo._transition_info],
+                       dtype=np.int64)
+    return edges, offsets
+
+
+def _utc_offsets(seconds, timezone: str):
+    """按时区转换规则批量求UTC偏移（秒），与 datetime.astimezone 结果一致"""
+    import numpy as np
+
+    edges, offsets = _transition_table(timezone)
+    return offsets[np.searchsorted(edges, seconds, side="right")]
+
+
+def localize_batch(local_seconds, timezone: str):
+    """把当地时间（按UTC计的秒数）批量换算为UTC秒
+
+    夏令时重叠或跳过的时刻按标准时间解释，与 pytz localize(is_dst=False) 一致。
+    """
+    import numpy as np
+
+    local_seconds = np.asarray(local_seconds, dtype=np.float64)
+    # 切换点前后的偏移各自验证一次，恰有一个自洽时取之，否则（重叠或跳过）取标准时间
+    early = _utc_offsets(local_seconds - 86400, timezone)
+    late = _utc_offsets(local_seconds + 86400, timezone)
+    early_ok = _utc_offsets(local_seconds - early, timezone) == early
+    late_ok = _utc_offsets(local_seconds - late, timezone) == late
+    offset = np.where(early_ok & ~late_ok, early,
+                      np.where(late_ok & ~early_ok, late, np.minimum(early, late)))
+    return local_seconds - offset
+
+
+@metrics.timed("bazi_generate_batch_seconds")
+def generate_batch(timestamps, timezones="Asia/Shanghai") -> dict:
+    """批量排盘：输入UTC时间戳（秒或datetime64）与时区，返回整数编码的四柱与五行
+
+    返回 {"stem": (N, 4), "branch": (N, 4), "wuxing": (N, 5)}，
+    四柱列顺序见 PILLARS，五行列顺序见 ELEMENTS。
+    """
+    import numpy as np
+
+    ts = np.asarray(timestamps)
+    if np.issubdtype(ts.dtype, np.datetime64):
+        ts = ts.astype("datetime64[s]").astype(np.int64)
+    # 与 BaziCalculator 一致，按分钟精度计算
+    ts = np.floor(ts.astype(np.float64).ravel() / 60) * 60
+    n = ts.size
+
+    if isinstance(timezones, str):
+        tz_names, tz_codes = np.array([timezones]), np.zeros(n, dtype=np.intp)
+    else:
+        tz_names, tz_codes = np.unique(np.asarray(timezones, dtype=str).ravel(),
+                                       return_inverse=True)
+        if tz_codes.size != n:
+            raise ValueError("时区数量与时间戳数量不一致")
+
+    local = np.empty(n, dtype=np.float64)
+    for code, name in enumerate(tz_names):
+        mask = tz_codes == code
+        local[mask] = ts[mask] + _utc_offsets(ts[mask], str(name))
+    hour = np.floor(local / 3600).astype(np.int64) % 24
+
+    # 每个时间戳在节气表中做一次二分查找
+    table = np.frombuffer(solar_terms.load_table(), dtype=np.int64)
+    index = np.searchsorted(table, ts, side="right") - 1
+    if n and (index.min() < 0 or index.max() >= table.size - 1):
+        raise ValueError(f"超出节气表范围（{solar_terms.FIRST_YEAR}-{solar_terms.LAST_YEAR}年）")
+    term = index % 24
+
+    stem = np.empty((n, 4), dtype=np.int8)
+    branch = np.empty((n, 4), dtype=np.int8)
+
+    # 年柱（小寒、大寒仍属上一年）
+    year = solar_terms.FIRST_YEAR + index // 24 - (term < 2)
+    stem[:, 0] = (year - 4) % 10
+    branch[:, 0] = (year - 4) % 12
+
+    # 月柱（五虎遁）
+    branch[:, 1] = (term // 2 + 1) % 12
+    stem[:, 1] = (stem[:, 0] % 5 * 2 + 2 + (branch[:, 1] - 2) % 12) % 10
+
+    # 日柱（按当地日期查日历表）
+    day_index = bazi_calendar.day_ganzhi_array(np.floor(local / 86400).astype(np.int64))
+    stem[:, 2] = day_index % 10
+    branch[:, 2] = day_index % 12
+
+    # 时柱
+    branch[:, 3] = (hour + 1) // 2 % 12
+    stem[:, 3] = (stem[:, 2] % 5 * 2 + branch[:, 3]) % 10
+
+    # 五行：按天干计数，天干下标整除2即为 ELEMENTS 下标
+    wuxing = np.zeros((n, len(ELEMENTS)), dtype=np.int8)
+    for column in range(4):
+        wuxing[np.arange(n), stem[:, column] // 2] += 1
+
+    return {"stem": stem, "branch": branch, "wuxing": wuxing}
+
+
+def pack_batch(batch: dict):
+    """把 generate_batch 的结果打包为 (N, 8) 的 uint8 数组，逐行与 Chart.to_bytes 一致"""
+    import numpy as np
+
+    n = batch["stem"].shape[0]
+    packed = np.zeros((n, Chart.size), dtype=np.uint8)
+    packed[:, :4] = (batch["stem"].astype(np.uint8) << 4) | batch["branch"].astype(np.uint8)
+    counts = np.zeros(n, dtype=np.uint16)
+    for position in range(len(ELEMENTS)):
+        counts |= batch["wuxing"][:, position].astype(np.uint16) << (3 * position)
+    packed[:, 4] = counts & 0xFF
+    packed[:, 5] = counts >> 8
+    return packed
+
+
 if __name__ == "__main__":
     test_time = datetime(1990, 11, 22, 8, 0)
     calculator = BaziCalculator(test_time)
@@ -1,10 +1,22 @@
+import sys
+import time
+_START = time.perf_counter()  # 启动计时起点（--profile-startup）
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
+import json
 from bazi_core import BaziCalculator
 from bazi_analysis import BaziAnalyzer
+from bazi_history import ConversationHistory
+from bazi_jobs import JobScheduler, PRIORITY_ANALYSIS, PRIORITY_INTERACTIVE
+from bazi_session import SessionStore
+import bazi_metrics as metrics
 # from datetime_entry import DateTimeEntry
+import queue
 import threading
+
+# 启动时不加载，首次使用或窗口显示后在后台预热
+HEAVY_MODULES = ("openai", "httpx", "pydantic", "pytz", "dateutil", "tkcalendar", "lunardate")
 class DateTimeEntry(ttk.Frame):
     """自定义日期时间输入组件"""
     def __init__(self, master):
@@ -47,14 +59,221 @@ class DateTimeEntry(ttk.Frame):
         except ValueError:
             raise ValueError("无效的日期时间输入")
         
+class TextStreamRenderer:
+    """工作线程与界面之间的文本队列：按固定帧间隔把积压的片段合并为一次插入"""
+    def __init__(self, window, text_widget, interval_ms: int = 40):
+        self.window = window
+        self.text_widget = text_widget
+        self.interval_ms = interval_ms
+        self._queue = queue.SimpleQueue()
+        self.chunks = 0
+        self.flushes = 0
+        self.last_backlog = 0
+        self.max_backlog = 0
+
+    def put(self, content: str):
+        """可在任意线程调用"""
+        if content:
+            self._queue.put((time.perf_counter(), content))
+
+    def clear(self):
+        """丢弃尚未写入的片段"""
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def start(self):
+        self.window.after(self.interval_ms, self._flush)
+
+    def _flush(self):
+        parts = []
+        try:
+            while True:
+                parts.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        if parts:
+            start = time.perf_counter()
+            self.text_widget.insert(tk.END, "".join(content for _, content in parts))
+            self.text_widget.see(tk.END)
+            if metrics.is_enabled():
+                # 最早片段从产生到上屏的等待，以及本帧插入耗时
+                now = time.perf_counter()
+                metrics.observe("bazi_ui_flush_delay_seconds", now - parts[0][0])
+                metrics.observe("bazi_ui_flush_seconds", now - start)
+            self.chunks += len(parts)
+            self.flushes += 1
+            self.last_backlog = len(parts)
+            self.max_backlog = max(self.max_backlog, len(parts))
+        self.window.after(self.interval_ms, self._flush)
+
+    def metrics(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "flushes": self.flushes,
+            "chunks_per_flush": self.chunks / self.flushes if self.flushes else 0.0,
+            "backlog": self._queue.qsize(),
+            "last_backlog": self.last_backlog,
+            "max_backlog": self.max_backlog,
+        }
+
+
+class PrefetchedAnalysis:
+    """排盘后在后台预取的流式解析：工作线程写入片段，按下“AI解析”后由界面接管
+
+    key 由命盘、模型与密钥组成，任一变化即不再适用。
+    """
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.job = None
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.claimed = False  # 已被解析任务接管
+        self.started = time.perf_counter()
+        self._cond = threading.Condition()
+
+    def run(self, analyzer: BaziAnalyzer, report: dict, job):
+        try:
+            response = analyzer.analyze(report, stream=True, on_cancel=job.on_cancel)
+            # 出错时 analyze 返回错误信息字符串，整体作为一个片段
+            for chunk in [response] if isinstance(response, str) else response:
+                if job.cancelled:
+                    return
+                with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            if not job.cancelled:
+                self.error = e
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def iter_chunks(self, job=None):
+        """先给出已缓冲的片段，再跟随后续到达的片段，直到预取结束"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    if job and job.cancelled:
+                        return
+                    self._cond.wait(0.1)
+                chunks, finished = self.chunks[index:], self.done
+                index += len(chunks)
+            yield from chunks
+            if finished and index >= len(self.chunks):
+                break
+        if self.error is not None:
+            raise self.error
+
+    def discard(self):
+        if self.job is not None:
+            self.job.cancel()
+
+
 class BaziApp:
-    def __init__(self):
+    def __init__(self, use_cache: bool = True):
+        """use_cache 为 False 时不缓存分析结果（命令行 --no-cache）"""
         self.window = tk.Tk()
         self.window.title("AI 命理分析系统")
         self.window.geometry("1000x800")
+        self.session_store = self._open_session_store()
+        self.cache = self._open_cache() if use_cache else None
+        self.session_id = None
         self._create_widgets()
         self.streaming = False
         self.current_report = None
+        self.prefetch = None
+        # 有界工作线程池：提问优先于完整解析，新的解析会取消旧的；
+        # 预取解析占用一个线程，接管它的解析任务占用另一个
+        self.scheduler = JobScheduler(workers=3)
+        self.window.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.warmup_seconds = None
+        # 窗口显示后再在后台加载重量级依赖，首次点击“AI解析”时无需等待导入
+        self.window.after(200, self._start_warmup)
+        self._resume_session()
+
+    def _open_session_store(self):
+        try:
+            store = SessionStore()
+        except Exception as e:
+            print(f"会话记录不可用：{e}", file=sys.stderr)
+            return None
+        store.start_compaction()
+        return store
+
+    def _open_cache(self):
+        from bazi_cache import ResponseCache
+
+        try:
+            return ResponseCache()
+        except Exception as e:
+            print(f"分析缓存不可用：{e}", file=sys.stderr)
+            return None
+
+    def _journal(self, role: str, content: str):
+        """每条消息产生时写入会话记录（工作线程中调用）"""
+        if self.session_store is None or self.session_id is None:
+            return
+        try:
+            self.session_store.append(self.session_id, role, content)
+        except Exception as e:
+            print(f"写入会话记录失败：{e}", file=sys.stderr)
+
+    def _resume_session(self):
+        """启动时恢复最近一次会话的命盘与对话"""
+        if self.session_store is None:
+            return
+        try:
+            session_id = self.session_store.latest_session()
+            if session_id is None:
+                return
+            session = self.session_store.load(session_id)
+        except Exception as e:
+            print(f"恢复会话失败：{e}", file=sys.stderr)
+            return
+        if session["report"] is None:
+            return
+        self.session_id = session_id
+        self.current_report = session["report"]
+        self.conversation_history.restore(session["report"], session["turns"], session["summary"])
+        self._show_report(session["report"])
+        for turn in session["turns"]:
+            if turn["role"] == "user":
+                self.result_text.insert(tk.END, f"\n\n[用户提问] {turn['content']}\n")
+            elif turn["role"] == "assistant":
+                self.result_text.insert(tk.END, turn["content"])
+        count = len(session["turns"]) + session["omitted"]
+        self.status_var.set(f"已恢复上次会话（{count} 条消息）")
+
+    def _start_warmup(self):
+        threading.Thread(target=self._warmup, daemon=True).start()
+
+    def _warmup(self):
+        start = time.perf_counter()
+        try:
+            import openai  # noqa: F401
+            import openai.types.chat  # noqa: F401
+            import solar_terms
+            from bazi_core import _get_timezone
+            _get_timezone("Asia/Shanghai")
+            solar_terms.load_table()
+        except Exception as e:
+            print(f"后台预热失败：{e}", file=sys.stderr)
+        self.warmup_seconds = time.perf_counter() - start
+
+    def _on_close(self):
+        self.scheduler.shutdown()
+        if self.session_store is not None:
+            self.session_store.close()
+        if self.cache is not None:
+            self.cache.close()
+        self.window.destroy()
 
     def _get_base_report(self) -> dict:
         """获取当前命盘数据"""
@@ -69,11 +288,12 @@ class BaziApp:
         
         # 模型选择
         ttk.Label(control_frame, text="选择模型：").grid(row=0, column=0)
-        self.model_var = tk.StringVar(value=BaziAnalyzer.SUPPORTED_MODELS[0])
+        models = BaziAnalyzer.available_models()
+        self.model_var = tk.StringVar(value=models[0])
         self.model_menu = ttk.Combobox(
             control_frame,
             textvariable=self.model_var,
-            values=BaziAnalyzer.SUPPORTED_MODELS,
+            values=models,
             width=30,
             state="readonly"
         )
@@ -88,6 +308,15 @@ class BaziApp:
             command=self._toggle_stream
         ).grid(row=0, column=2, padx=10)
 
+        # 排盘后立即在后台请求解析
+        self.prefetch_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            control_frame,
+            text="排盘后预取解析",
+            variable=self.prefetch_var,
+            command=self._toggle_prefetch
+        ).grid(row=0, column=3, padx=10)
+
         # 输入区域
         input_frame = ttk.LabelFrame(self.window, text="出生信息")
         input_frame.pack(padx=10, pady=10, fill="x")
@@ -104,9 +333,16 @@ class BaziApp:
 
         # API密钥
         ttk.Label(input_frame, text="API密钥：").grid(row=1, column=0, sticky="e")
-        self.api_entry = ttk.Entry(input_frame, width=50)
+        self.api_var = tk.StringVar()
+        self.api_entry = ttk.Entry(input_frame, width=50, textvariable=self.api_var)
         self.api_entry.grid(row=1, column=1, columnspan=3, sticky="w", padx=5)
 
+        # 输入变化后预取的解析不再适用
+        for var in (self.datetime_entry.year_var, self.datetime_entry.month_var,
+                    self.datetime_entry.day_var, self.datetime_entry.hour_var,
+                    self.datetime_entry.minute_var, self.model_var, self.api_var):
+            var.trace_add("write", lambda *_: self._discard_prefetch())
+
         # 按钮区域
         btn_frame = ttk.Frame(self.window)
         btn_frame.pack(pady=10)
@@ -123,7 +359,7 @@ class BaziApp:
                  command=self.ask_question).pack(side="left")
         
         # 初始化对话历史
-        self.conversation_history = []
+        self.conversation_history = ConversationHistory(journal=self._journal)
 
         # 结果展示
         self.result_text = tk.Text(
@@ -134,6 +370,8 @@ class BaziApp:
             pady=10
         )
         self.result_text.pack(expand=True, fill="both")
+        self.renderer = TextStreamRenderer(self.window, self.result_text)
+        self.renderer.start()
 
         # 状态栏
         self.status_var = tk.StringVar()
@@ -151,86 +389,149 @@ class BaziApp:
         
         try:
             # 保存对话历史
-            self.conversation_history.append({"role": "user", "content": question})
+            self.conversation_history.add_user(question)
             
-            # 在子线程中处理
-            threading.Thread(
-                target=self._process_question,
-                args=(question,),
-                daemon=True
-            ).start()
+            # 交给调度器处理（优先于完整解析）
+            self.scheduler.submit(
+                lambda job: self._process_question(question, job),
+                priority=PRIORITY_INTERACTIVE
+            )
             
         except Exception as e:
             messagebox.showerror("错误", str(e))
 
-    def _process_question(self, question: str):
+    def _process_question(self, question: str, job=None):
         """处理问题并获取回答"""
         response_content = ""  # 初始化响应内容
         
         try:
             analyzer = BaziAnalyzer(
                 api_key=self.api_entry.get(),
-                model=self.model_var.get()
+                model=self.model_var.get(),
+                cache=self.cache
             )
             full_prompt = self._build_full_prompt()
             
             self._update_display(f"\n\n[用户提问] {question}\n[AI正在思考...]")
             
+            on_cancel = job.on_cancel if job else None
             if self.streaming:
-                response_stream = analyzer.analyze_with_history(full_prompt, stream=True)
+                response_stream = analyzer.analyze_with_history(
+                    full_prompt, stream=True, on_cancel=on_cancel)
+                if isinstance(response_stream, str):
+                    raise RuntimeError(response_stream)
+                parts = []  # 累积响应内容
                 for chunk in response_stream:
-                    response_content += chunk  # 累积响应内容
-                    self._update_display(chunk)
+                    if job and job.cancelled:
+                        return
+                    if chunk:
+                        parts.append(chunk)
+                        self._update_display(chunk)
+                response_content = "".join(parts)
             else:
-                response_content = analyzer.analyze_with_history(full_prompt)  # 直接获取响应
+                response_content = analyzer.analyze_with_history(  # 直接获取响应
+                    full_prompt, on_cancel=on_cancel)
+                if job and job.cancelled:
+                    return
+                if response_content.startswith("[API错误]"):
+                    raise RuntimeError(response_content)
                 self._update_display(f"\n{response_content}")
                 
             # 保存完整响应到历史记录
-            self.conversation_history.append(
-                {"role": "assistant", "content": response_content}
-            )
+            self.conversation_history.add_assistant(response_content)
             
         except Exception as e:
+            if job and job.cancelled:
+                return
             error_msg = f"\n[错误] {str(e)}"
             self._update_display(error_msg)
-            self.conversation_history.append(
-                {"role": "system", "content": error_msg}
-            )
+            # 错误只做记录，不进入后续请求的上下文
+            self.conversation_history.add_error(error_msg)
 
     def _build_full_prompt(self) -> list:
-        """构建包含历史记录的完整prompt"""
-        base_report = self._get_base_report()  # 获取排盘数据
-        return [
-            {"role": "system", "content": f"八字排盘数据：{base_report}"}
-        ] + self.conversation_history
+        """构建包含历史记录的完整prompt（受 token 预算约束）"""
+        self._get_base_report()  # 确认已排盘
+        messages = self.conversation_history.build_prompt()
+        stats = self.conversation_history.metrics()
+        self.window.after(0, lambda: self.status_var.set(
+            f"上下文约 {stats['prompt_tokens']} tokens（{stats['turns']} 条消息，"
+            f"{stats['summarized_turns']} 条摘要）"))
+        return messages
 
     def _update_display(self, content: str):
-        """线程安全的显示更新"""
-        self.window.after(0, lambda: self.result_text.insert(tk.END, content))
-        self.window.after(0, lambda: self.result_text.see(tk.END))
+        """线程安全的显示更新（由渲染器按帧合并写入）"""
+        self.renderer.put(content)
         
     def generate_report(self):
         try:
+            # 重新排盘后，旧命盘的解析与提问都已过时
+            self.scheduler.cancel_all()
+            self.renderer.clear()
             birth_time = self.datetime_entry.get_datetime()
             calculator = BaziCalculator(birth_time)
             report = calculator.generate_report()
 
             self.current_report = report
+            self.conversation_history.set_report(report)
+            self._discard_prefetch()
+            if self.prefetch_var.get():
+                self._start_prefetch(report)
+            # 每次排盘开始一个新会话
+            if self.session_store is not None:
+                try:
+                    self.session_id = self.session_store.create_session(report)
+                except Exception as e:
+                    self.session_id = None
+                    print(f"创建会话记录失败：{e}", file=sys.stderr)
 
-            self.result_text.delete(1.0, tk.END)
-            self.result_text.insert(tk.END, "【命盘结构】\n")
-            self.result_text.insert(tk.END, f"年柱：{report['sizhu']['year']}\n")
-            self.result_text.insert(tk.END, f"月柱：{report['sizhu']['month']}\n")
-            self.result_text.insert(tk.END, f"日柱：{report['sizhu']['day']}\n")
-            self.result_text.insert(tk.END, f"时柱：{report['sizhu']['hour']}\n\n")
-            self.result_text.insert(tk.END, "【五行分布】\n")
-            for element, count in report['wuxing'].items():
-                self.result_text.insert(tk.END, f"{element}：{'★' * count}\n")
+            self._show_report(report)
             
         except Exception as e:
             self.current_report = None
             messagebox.showerror("错误", f"排盘失败：{str(e)}")
 
+    def _show_report(self, report: dict):
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, "【命盘结构】\n")
+        self.result_text.insert(tk.END, f"年柱：{report['sizhu']['year']}\n")
+        self.result_text.insert(tk.END, f"月柱：{report['sizhu']['month']}\n")
+        self.result_text.insert(tk.END, f"日柱：{report['sizhu']['day']}\n")
+        self.result_text.insert(tk.END, f"时柱：{report['sizhu']['hour']}\n\n")
+        self.result_text.insert(tk.END, "【五行分布】\n")
+        for element, count in report['wuxing'].items():
+            self.result_text.insert(tk.END, f"{element}：{'★' * count}\n")
+
+    def _prefetch_key(self, report: dict) -> tuple:
+        return (json.dumps(report, ensure_ascii=False, sort_keys=True),
+                self.model_var.get(), self.api_entry.get().strip())
+
+    def _start_prefetch(self, report: dict):
+        api_key = self.api_entry.get().strip()
+        if not api_key.startswith("sk-"):
+            self.status_var.set("未填写有效的API密钥，跳过预取解析")
+            return
+        prefetch = PrefetchedAnalysis(self._prefetch_key(report))
+        analyzer = BaziAnalyzer(api_key=api_key, model=self.model_var.get(), cache=self.cache)
+        prefetch.job = self.scheduler.submit(
+            lambda job: prefetch.run(analyzer, report, job),
+            priority=PRIORITY_ANALYSIS, group="prefetch")
+        self.prefetch = prefetch
+        self.status_var.set("已在后台预取解析")
+
+    def _discard_prefetch(self):
+        if self.prefetch is not None:
+            # 已被接管的预取由接管它的解析任务负责，随 scheduler 一起取消
+            if not self.prefetch.claimed:
+                self.prefetch.discard()
+            self.prefetch = None
+
+    def _toggle_prefetch(self):
+        if self.prefetch_var.get():
+            if self.current_report is not None:
+                self._start_prefetch(self.current_report)
+        else:
+            self._discard_prefetch()
+
     def _toggle_stream(self):
         """切换流式输出模式"""
         self.streaming = self.stream_var.get()
@@ -246,57 +547,77 @@ class BaziApp:
             messagebox.showerror("错误", "API密钥格式不正确（必须以sk-开头）")
             return
 
-        # 添加线程状态检测
-        if hasattr(self, '_analysis_thread') and self._analysis_thread.is_alive():
-            messagebox.showwarning("警告", "已有分析任务在进行中")
-            return
+        # 复用已排好的命盘；尚未排盘时先排盘
+        if self.current_report is None:
+            self.generate_report()
+            if self.current_report is None:
+                return
+        report = self.current_report
 
-        try:
-            self._analysis_thread = threading.Thread(
-                target=self._perform_analysis,
-                daemon=True
-            )
-            self._analysis_thread.start()
-            
-        except Exception as e:
-            messagebox.showerror("线程错误", f"无法启动分析线程：{str(e)}")
+        prefetch = self.prefetch
+        if prefetch is not None and prefetch.key != self._prefetch_key(report):
+            self._discard_prefetch()
+            prefetch = None
+        if prefetch is not None:
+            prefetch.claimed = True
+            self.status_var.set(
+                f"使用预取的解析（已提前 {time.perf_counter() - prefetch.started:.1f} 秒发出）")
 
-    def _perform_analysis(self):
+        # 新的解析取代尚未完成的旧解析
+        self.scheduler.submit(lambda job: self._perform_analysis(report, job, prefetch),
+                              priority=PRIORITY_ANALYSIS, group="analysis")
+
+    def _perform_analysis(self, report: dict, job=None, prefetch: PrefetchedAnalysis = None):
+        started = time.perf_counter()
         try:
-            print("\n=== 开始分析流程 ===")
-            
-            # 验证日期输入
-            try:
-                birth_time = self.datetime_entry.get_datetime()
-                print(f"输入的日期时间：{birth_time} (时区：{birth_time.tzinfo})")
-            except Exception as e:
-                messagebox.showerror("日期错误", f"日期输入无效：{str(e)}")
+            metrics.inc("bazi_analysis_total")
+            if prefetch is not None:
+                metrics.inc("bazi_analysis_prefetched_total")
+                # 接管预取结果：已到达的片段立即显示，其余随到随显示
+                if self.streaming:
+                    for chunk in prefetch.iter_chunks(job):
+                        if job and job.cancelled:
+                            metrics.inc("bazi_analysis_cancelled_total")
+                            return
+                        self._update_display(chunk)
+                else:
+                    analysis = "".join(prefetch.iter_chunks(job))
+                    if job and job.cancelled:
+                        metrics.inc("bazi_analysis_cancelled_total")
+                        return
+                    self._update_display(analysis)
+                metrics.observe("bazi_analysis_seconds", time.perf_counter() - started)
                 return
-                
-            # 生成命盘报告
-            calculator = BaziCalculator(birth_time)
-            report = calculator.generate_report()
-            print("生成的命盘报告：", report)
-            
+
             # 调用API分析
             analyzer = BaziAnalyzer(
                 api_key=self.api_entry.get().strip(),
-                model=self.model_var.get()
+                model=self.model_var.get(),
+                cache=self.cache
             )
-            print(f"使用的模型：{analyzer.model}")
             
+            on_cancel = job.on_cancel if job else None
             # 流式处理
             if self.streaming:
-                response_stream = analyzer.analyze(report, stream=True)
+                response_stream = analyzer.analyze(report, stream=True, on_cancel=on_cancel)
                 for chunk in response_stream:
-                    self.window.after(0, self._update_text, chunk)
+                    if job and job.cancelled:
+                        metrics.inc("bazi_analysis_cancelled_total")
+                        return
+                    self._update_display(chunk)
             else:
-                analysis = analyzer.analyze(report)
-                self.window.after(0, self._update_text, analysis)
+                analysis = analyzer.analyze(report, on_cancel=on_cancel)
+                if job and job.cancelled:
+                    metrics.inc("bazi_analysis_cancelled_total")
+                    return
+                self._update_display(analysis)
                 
-            print("=== 分析完成 ===")
+            metrics.observe("bazi_analysis_seconds", time.perf_counter() - started)
             
         except Exception as e:
+            if job and job.cancelled:
+                return
+            metrics.inc("bazi_analysis_errors_total")
             error_msg = f"""
             分析过程中发生错误：
             {str(e)}
@@ -311,12 +632,28 @@ class BaziApp:
         finally:
             self.window.after(0, lambda: self.model_menu.config(state="readonly"))
 
-    def _update_text(self, content: str):
-        """线程安全的文本更新"""
-        self.result_text.insert(tk.END, content)
-        self.result_text.see(tk.END)
-        self.window.update_idletasks()
+def _profile_startup(app: BaziApp, imported: float, created: float):
+    """打印启动耗时：模块导入、窗口构建、首次显示，以及启动时已加载的重量级模块"""
+    app.window.update()
+    shown = time.perf_counter()
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(f"模块导入：{(imported - _START) * 1000:.1f} ms", file=sys.stderr)
+    print(f"窗口构建：{(created - imported) * 1000:.1f} ms", file=sys.stderr)
+    print(f"首次显示：{(shown - _START) * 1000:.1f} ms", file=sys.stderr)
+    print(f"启动时已加载的重量级模块：{', '.join(loaded) or '无'}", file=sys.stderr)
+
+    def report_warmup():
+        if app.warmup_seconds is None:
+            app.window.after(100, report_warmup)
+        else:
+            print(f"后台预热：{app.warmup_seconds * 1000:.1f} ms", file=sys.stderr)
+    report_warmup()
+
 
 if __name__ == "__main__":
-    app = BaziApp()
+    metrics.configure_from_env()
+    imported = time.perf_counter()
+    app = BaziApp(use_cache="--no-cache" not in sys.argv[1:])
+    if "--profile-startup" in sys.argv[1:]:
+        _profile_startup(app, imported, time.perf_counter())
     app.window.mainloop()
\ No newline at end of file
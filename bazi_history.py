@@ -0,0 +1,138 @@
+"""对话历史管理
+
+按 token 预算组装多轮对话的 prompt：命盘数据只紧凑序列化一次，
+超出预算时把最早的轮次压缩进摘要，摘要也放不下时直接丢弃；
+错误信息单独记录，不再混入发送给模型的消息。
+各方法可在多个线程中调用（界面线程与 JobScheduler 的工作线程）。
+"""
+import json
+import re
+import threading
+
+_WIDE_CHAR = re.compile(r"[⺀-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文等宽字符约1个，其余约4个字符1个"""
+    wide = len(_WIDE_CHAR.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+class ConversationHistory:
+    def __init__(self, token_budget: int = 4000, keep_recent: int = 2,
+                 summary_budget: int = 400, excerpt_chars: int = 40, journal=None):
+        """keep_recent 为无论预算如何都保留的最近消息条数；
+        journal(role, content) 在每条消息（含错误，role 为 "error"）记录时调用，用于持久化"""
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.summary_budget = summary_budget
+        self.excerpt_chars = excerpt_chars
+        self.journal = journal
+        self.turns = []
+        self.errors = []
+        self.summary_lines = []
+        self.dropped_turns = 0
+        self._report_message = None
+        self._report_tokens = 0
+        self._last_prompt_tokens = 0
+        # 修改与读取快照都在锁内进行；可重入，set_report 内调用 clear
+        self._lock = threading.RLock()
+
+    def set_report(self, report: dict):
+        """设置命盘数据；换盘后旧对话不再适用，一并清空"""
+        content = "八字排盘数据：" + json.dumps(report, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._report_message = {"role": "system", "content": content}
+            self._report_tokens = estimate_tokens(content)
+            self.clear()
+
+    def add_user(self, content: str):
+        self._append("user", content)
+
+    def add_assistant(self, content: str):
+        self._append("assistant", content)
+
+    def add_error(self, content: str):
+        with self._lock:
+            self.errors.append(content)
+            if self.journal is not None:
+                self.journal("error", content)
+
+    def _append(self, role: str, content: str):
+        turn = {"role": role, "content": content, "tokens": estimate_tokens(content)}
+        with self._lock:
+            self.turns.append(turn)
+            if self.journal is not None:
+                self.journal(role, content)
+
+    def restore(self, report: dict, turns: list, summary_lines: list = ()):
+        """从持久化的会话恢复，不再经过 journal 写回"""
+        with self._lock:
+            self.set_report(report)
+            self.summary_lines.extend(summary_lines)
+            for turn in turns:
+                if turn["role"] == "error":
+                    self.errors.append(turn["content"])
+                else:
+                    self.turns.append({"role": turn["role"], "content": turn["content"],
+                                       "tokens": estimate_tokens(turn["content"])})
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+            self.errors.clear()
+            self.summary_lines.clear()
+            self.dropped_turns = 0
+
+    def _excerpt(self, turn: dict) -> str:
+        label = "问" if turn["role"] == "user" else "答"
+        text = " ".join(turn["content"].split())
+        if len(text) > self.excerpt_chars:
+            text = text[:self.excerpt_chars] + "…"
+        return f"{label}：{text}"
+
+    def _summary_message(self):
+        if not self.summary_lines:
+            return None
+        return {"role": "system", "content": "此前对话摘要：\n" + "\n".join(self.summary_lines)}
+
+    def _compact(self):
+        """把超出预算的最早轮次移入摘要，摘要超出自身预算时丢弃最早的摘要行"""
+        def total():
+            summary = self._summary_message()
+            return (self._report_tokens + sum(t["tokens"] for t in self.turns)
+                    + (estimate_tokens(summary["content"]) if summary else 0))
+
+        while total() > self.token_budget and len(self.turns) > self.keep_recent:
+            self.summary_lines.append(self._excerpt(self.turns.pop(0)))
+            while (self.summary_lines
+                   and estimate_tokens("\n".join(self.summary_lines)) > self.summary_budget):
+                self.summary_lines.pop(0)
+                self.dropped_turns += 1
+        while total() > self.token_budget and self.summary_lines:
+            self.summary_lines.pop(0)
+            self.dropped_turns += 1
+
+    def build_prompt(self) -> list:
+        with self._lock:
+            if self._report_message is None:
+                raise ValueError("请先进行排盘分析")
+            self._compact()
+            messages = [self._report_message]
+            summary = self._summary_message()
+            if summary:
+                messages.append(summary)
+            messages += [{"role": t["role"], "content": t["content"]} for t in self.turns]
+            self._last_prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+            return messages
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "prompt_tokens": self._last_prompt_tokens,
+                "token_budget": self.token_budget,
+                "turns": len(self.turns),
+                "summarized_turns": len(self.summary_lines),
+                "dropped_turns": self.dropped_turns,
+                "errors": len(self.errors),
+            }
@@ -0,0 +1,105 @@
+"""分析任务调度
+
+固定数量的工作线程按优先级取任务（数值越小越先执行），同组的新任务会
+取消旧任务；取消时执行任务登记的关闭回调（例如关闭HTTP流），
+使被放弃的请求立即停止消耗 token 与线程。
+"""
+import itertools
+import queue
+import threading
+import traceback
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ANALYSIS = 10
+
+
+class Job:
+    def __init__(self, fn, priority: int, group: str = None):
+        self.fn = fn
+        self.priority = priority
+        self.group = group
+        self._cancelled = threading.Event()
+        self._closers = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def on_cancel(self, closer):
+        """登记取消时的回调；任务已被取消时立即执行"""
+        with self._lock:
+            if not self.cancelled:
+                self._closers.append(closer)
+                return
+        self._run_closer(closer)
+
+    def on_cancel_close(self, resource):
+        """取消时关闭资源（如流式HTTP响应）"""
+        self.on_cancel(resource.close)
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self._cancelled.set()
+            closers, self._closers = self._closers, []
+        for closer in closers:
+            self._run_closer(closer)
+
+    @staticmethod
+    def _run_closer(closer):
+        try:
+            closer()
+        except Exception:
+            pass
+
+
+class JobScheduler:
+    def __init__(self, workers: int = 2):
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._active = set()
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, priority: int = PRIORITY_ANALYSIS, group: str = None) -> Job:
+        """提交任务，fn 以 Job 为参数调用；指定 group 时取消同组的旧任务"""
+        job = Job(fn, priority, group)
+        with self._lock:
+            if group is not None:
+                for other in self._active:
+                    if other.group == group:
+                        other.cancel()
+            self._active.add(job)
+        self._queue.put((priority, next(self._counter), job))
+        return job
+
+    def cancel_all(self, group: str = None):
+        with self._lock:
+            for job in self._active:
+                if group is None or job.group == group:
+                    job.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._counter), None))
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            try:
+                if not job.cancelled:
+                    job.fn(job)
+            except Exception:
+                if not job.cancelled:
+                    traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._active.discard(job)
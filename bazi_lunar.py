@@ -0,0 +1,177 @@
+"""农历与公历互转
+
+以 1900-2100 年的压缩年表为基础（每年一个整数，编码同常见的 lunarInfo 表：
+第4-15位为正月至十二月大小月，低4位为闰月月份，第16位为闰月大小），
+导入时展开为按月顺序排列的月首日序表，两个方向的换算都只做常数次整数运算，
+无需逐年逐月累加。数组接口（*_array）供批量导入使用。
+
+    to_solar(2023, 2, 1, leap=True)   -> date(2023, 3, 22)
+    from_solar(date(2023, 3, 22))     -> LunarDay(year=2023, month=2, day=1, leap=True)
+"""
+from array import array
+from collections import namedtuple
+from datetime import date
+
+FIRST_YEAR = 1900
+LAST_YEAR = 2100
+
+LunarDay = namedtuple("LunarDay", ["year", "month", "day", "leap"])
+
+_YEAR_INFO = (
+    0x04bd8, 0x04ae0, 0x0a570, 0x054d5, 0x0d260, 0x0d950, 0x16554, 0x056a0, 0x09ad0, 0x055d2,  # 1900
+    0x04ae0, 0x0a5b6, 0x0a4d0, 0x0d250, 0x1d255, 0x0b540, 0x0d6a0, 0x0ada2, 0x095b0, 0x14977,  # 1910
+    0x04970, 0x0a4b0, 0x0b4b5, 0x06a50, 0x06d40, 0x1ab54, 0x02b60, 0x09570, 0x052f2, 0x04970,  # 1920
+    0x06566, 0x0d4a0, 0x0ea50, 0x06e95, 0x05ad0, 0x02b60, 0x186e3, 0x092e0, 0x1c8d7, 0x0c950,  # 1930
+    0x0d4a0, 0x1d8a6, 0x0b550, 0x056a0, 0x1a5b4, 0x025d0, 0x092d0, 0x0d2b2, 0x0a950, 0x0b557,  # 1940
+    0x06ca0, 0x0b550, 0x15355, 0x04da0, 0x0a5d0, 0x14573, 0x052b0, 0x0a9a8, 0x0e950, 0x06aa0,  # 1950
+    0x0aea6, 0x0ab50, 0x04b60, 0x0aae4, 0x0a570, 0x05260, 0x0f263, 0x0d950, 0x05b57, 0x056a0,  # 1960
+    0x096d0, 0x04dd5, 0x04ad0, 0x0a4d0, 0x0d4d4, 0x0d250, 0x0d558, 0x0b540, 0x0b5a0, 0x195a6,  # 1970
+    0x095b0, 0x049b0, 0x0a974, 0x0a4b0, 0x0b27a, 0x06a50, 0x06d40, 0x0af46, 0x0ab60, 0x09570,  # 1980
+    0x04af5, 0x04970, 0x064b0, 0x074a3, 0x0ea50, 0x06b58, 0x05ac0, 0x0ab60, 0x096d5, 0x092e0,  # 1990
+    0x0c960, 0x0d954, 0x0d4a0, 0x0da50, 0x07552, 0x056a0, 0x0abb7, 0x025d0, 0x092d0, 0x0cab5,  # 2000
+    0x0a950, 0x0b4a0, 0x0baa4, 0x0ad50, 0x055d9, 0x04ba0, 0x0a5b0, 0x15176, 0x052b0, 0x0a930,  # 2010
+    0x07954, 0x06aa0, 0x0ad50, 0x05b52, 0x04b60, 0x0a6e6, 0x0a4e0, 0x0d260, 0x0ea65, 0x0d530,  # 2020
+    0x05aa0, 0x076a3, 0x096d0, 0x04afb, 0x04ad0, 0x0a4d0, 0x1d0b6, 0x0d250, 0x0d520, 0x0dd45,  # 2030
+    0x0b5a0, 0x056d0, 0x055b2, 0x049b0, 0x0a577, 0x0a4b0, 0x0aa50, 0x1b255, 0x06d20, 0x0ada0,  # 2040
+    0x14b63, 0x09370, 0x049f8, 0x04970, 0x064b0, 0x168a6, 0x0ea50, 0x06aa0, 0x1a6c4, 0x0aae0,  # 2050
+    0x092e0, 0x0d2e3, 0x0c960, 0x0d557, 0x0d4a0, 0x0da50, 0x05d55, 0x056a0, 0x0a6d0, 0x055d4,  # 2060
+    0x052d0, 0x0a9b8, 0x0a950, 0x0b4a0, 0x0b6a6, 0x0ad50, 0x055a0, 0x0aba4, 0x0a5b0, 0x052b0,  # 2070
+    0x0b273, 0x06930, 0x07337, 0x06aa0, 0x0ad50, 0x14b55, 0x04b60, 0x0a570, 0x054e4, 0x0d160,  # 2080
+    0x0e968, 0x0d520, 0x0daa0, 0x16aa6, 0x056d0, 0x04ae0, 0x0a9d4, 0x0a2d0, 0x0d150, 0x0f252,  # 2090
+    0x0d520,                                                                                    # 2100
+)
+
+# 1900年正月初一
+_BASE = date(1900, 1, 31).toordinal()
+_MEAN_MONTH = 29.530588853
+_UNIX_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _expand():
+    """展开为按月顺序的表：月首距 _BASE 的天数、所属年月与是否闰月，以及每年首月下标"""
+    starts, years, months, leaps, year_first = array("i"), array("h"), array("b"), array("b"), array("i")
+    offset = 0
+    for i, info in enumerate(_YEAR_INFO):
+        year_first.append(len(starts))
+        leap_month = info & 0xF
+        for month in range(1, 13):
+            for leap in ((False, True) if month == leap_month else (False,)):
+                starts.append(offset)
+                years.append(FIRST_YEAR + i)
+                months.append(month)
+                leaps.append(leap)
+                if leap:
+                    offset += 30 if info & 0x10000 else 29
+                else:
+                    offset += 30 if info & (0x10000 >> month) else 29
+    starts.append(offset)
+    year_first.append(len(starts) - 1)
+    return starts, years, months, leaps, year_first
+
+
+_STARTS, _YEARS, _MONTHS, _LEAPS, _YEAR_FIRST = _expand()
+_MONTH_COUNT = len(_YEARS)
+
+
+def _check_year(year: int):
+    if not FIRST_YEAR <= year <= LAST_YEAR:
+        raise ValueError(f"超出农历表范围（{FIRST_YEAR}-{LAST_YEAR}年）")
+
+
+def leap_month(year: int) -> int:
+    """该年闰几月，无闰月返回 0"""
+    _check_year(year)
+    return _YEAR_INFO[year - FIRST_YEAR] & 0xF
+
+
+def _month_index(year: int, month: int, leap: bool) -> int:
+    _check_year(year)
+    if not 1 <= month <= 12:
+        raise ValueError(f"无效的农历月份：{month}")
+    lm = _YEAR_INFO[year - FIRST_YEAR] & 0xF
+    if leap and lm != month:
+        raise ValueError(f"农历{year}年没有闰{month}月")
+    return _YEAR_FIRST[year - FIRST_YEAR] + month - 1 + (lm != 0 and (month > lm or leap))
+
+
+def month_days(year: int, month: int, leap: bool = False) -> int:
+    index = _month_index(year, month, leap)
+    return _STARTS[index + 1] - _STARTS[index]
+
+
+def to_solar_ordinal(year: int, month: int, day: int, leap: bool = False) -> int:
+    """农历日期对应的公历日序（date.toordinal）"""
+    index = _month_index(year, month, leap)
+    start = _STARTS[index]
+    if not 1 <= day <= _STARTS[index + 1] - start:
+        raise ValueError(f"无效的农历日期：{year}年{'闰' if leap else ''}{month}月{day}日")
+    return _BASE + start + day - 1
+
+
+def to_solar(year: int, month: int, day: int, leap: bool = False) -> date:
+    return date.fromordinal(to_solar_ordinal(year, month, day, leap))
+
+
+def from_solar_ordinal(ordinal: int) -> LunarDay:
+    offset = ordinal - _BASE
+    if not 0 <= offset < _STARTS[-1]:
+        raise ValueError(f"超出农历表范围（{FIRST_YEAR}-{LAST_YEAR}年）")
+    # 按平均朔望月估计月下标，累计误差不超过一两个月，修正几步即可
+    index = min(int(offset / _MEAN_MONTH), _MONTH_COUNT - 1)
+    while _STARTS[index] > offset:
+        index -= 1
+    while _STARTS[index + 1] <= offset:
+        index += 1
+    return LunarDay(_YEARS[index], _MONTHS[index], offset - _STARTS[index] + 1, bool(_LEAPS[index]))
+
+
+def from_solar(solar: date) -> LunarDay:
+    return from_solar_ordinal(solar.toordinal())
+
+
+def _tables():
+    import numpy as np
+
+    return (np.frombuffer(_STARTS, dtype=np.int32), np.frombuffer(_YEAR_FIRST, dtype=np.int32),
+            np.array(_YEAR_INFO, dtype=np.int32))
+
+
+def to_solar_array(years, months, days, leaps=None):
+    """批量农历转公历，返回 datetime64[D] 数组；任一日期无效时抛出 ValueError"""
+    import numpy as np
+
+    starts, year_first, year_info = _tables()
+    years, months, days = (np.asarray(a, dtype=np.int64) for a in (years, months, days))
+    leaps = np.zeros(years.shape, dtype=bool) if leaps is None else np.asarray(leaps, dtype=bool)
+    if years.size and (years.min() < FIRST_YEAR or years.max() > LAST_YEAR):
+        raise ValueError(f"超出农历表范围（{FIRST_YEAR}-{LAST_YEAR}年）")
+    if months.size and (months.min() < 1 or months.max() > 12):
+        raise ValueError("无效的农历月份")
+    row = years - FIRST_YEAR
+    lm = year_info[row] & 0xF
+    if np.any(leaps & (lm != months)):
+        raise ValueError("闰月不存在")
+    index = year_first[row] + months - 1 + ((lm != 0) & ((months > lm) | leaps))
+    start = starts[index]
+    if np.any((days < 1) | (days > starts[index + 1] - start)):
+        raise ValueError("无效的农历日期")
+    ordinal = _BASE + start + days - 1
+    return (ordinal - _UNIX_ORDINAL).astype("datetime64[D]")
+
+
+def from_solar_array(dates) -> dict:
+    """批量公历转农历，返回 {"year","month","day","leap"} 四个数组"""
+    import numpy as np
+
+    starts = _tables()[0]
+    offset = (np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+              + _UNIX_ORDINAL - _BASE)
+    if offset.size and (offset.min() < 0 or offset.max() >= starts[-1]):
+        raise ValueError(f"超出农历表范围（{FIRST_YEAR}-{LAST_YEAR}年）")
+    index = np.searchsorted(starts, offset, side="right") - 1
+    return {
+        "year": np.frombuffer(_YEARS, dtype=np.int16)[index],
+        "month": np.frombuffer(_MONTHS, dtype=np.int8)[index],
+        "day": (offset - starts[index] + 1).astype(np.int8),
+        "leap": np.frombuffer(_LEAPS, dtype=np.int8)[index].astype(bool),
+    }
@@ -0,0 +1,268 @@
+"""性能埋点
+
+计时（span / timed）、直方图（observe）与计数器（inc），
+导出为 Prometheus 文本或 JSON，可写入文件或通过本地 HTTP 端口提供。
+默认关闭，关闭时每个埋点只多一次全局标志判断：
+
+    with metrics.span("bazi_build_messages_seconds"):
+        ...
+
+通过环境变量开启：
+    BAZI_METRICS=1               只在进程内收集
+    BAZI_METRICS_FILE=m.prom     定期写入文件（.json 后缀写 JSON）
+    BAZI_METRICS_PORT=9464       在 127.0.0.1:9464/metrics 提供
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> dict:
+        cumulative, buckets = 0, {}
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "min": self.min if self.count else 0.0,
+                "max": self.max if self.count else 0.0,
+                "buckets": buckets}
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def inc(name: str, value: float = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float, buckets: tuple = SECONDS_BUCKETS):
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """计时上下文，耗时（秒）记入同名直方图"""
+    return _Span(name) if _enabled else _NOOP
+
+
+def timed(name: str):
+    """函数计时装饰器"""
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__qualname__ = fn.__qualname__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorator
+
+
+class StreamTimer:
+    """流式响应计时：请求发出到首个片段（TTFT）、总耗时与每秒 token 数
+
+    timer = StreamTimer("bazi_llm")
+    for chunk in stream:
+        timer.chunk(chunk)
+    timer.finish()
+    """
+    __slots__ = ("prefix", "start", "first", "text")
+
+    def __init__(self, prefix: str, start: float = None):
+        self.prefix = prefix
+        self.start = time.perf_counter() if start is None else start
+        self.first = None
+        self.text = []
+
+    def chunk(self, content: str):
+        if not _enabled:
+            return
+        if self.first is None:
+            self.first = time.perf_counter()
+            observe(self.prefix + "_ttft_seconds", self.first - self.start)
+        if content:
+            self.text.append(content)
+
+    def finish(self):
+        if not _enabled or self.first is None:
+            return
+        from bazi_history import estimate_tokens
+
+        end = time.perf_counter()
+        tokens = estimate_tokens("".join(self.text))
+        observe(self.prefix + "_stream_seconds", end - self.start)
+        inc(self.prefix + "_tokens_total", tokens)
+        if end > self.first:
+            observe(self.prefix + "_tokens_per_second", tokens / (end - self.first), RATE_BUCKETS)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "timestamp": time.time(),
+            "counters": dict(_counters),
+            "histograms": {name: h.to_dict() for name, h in _histograms.items()},
+        }
+
+
+def to_prometheus() -> str:
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data["counters"].items()):
+        lines += [f"# TYPE {name} counter", f"{name} {value}"]
+    for name, histogram in sorted(data["histograms"].items()):
+        lines.append(f"# TYPE {name} histogram")
+        for bound, count in histogram["buckets"].items():
+            lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+        lines += [f"{name}_sum {histogram['sum']}", f"{name}_count {histogram['count']}"]
+    return "\n".join(lines) + "\n"
+
+
+def write(path: str):
+    """写入文件（先写临时文件再替换），.json 后缀写 JSON，其余写 Prometheus 文本"""
+    if path.endswith(".json"):
+        text = json.dumps(snapshot(), ensure_ascii=False, indent=2)
+    else:
+        text = to_prometheus()
+    temp = path + ".tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp, path)
+
+
+def start_file_exporter(path: str, interval: float = 10.0) -> threading.Thread:
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write(path)
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+def start_http_server(port: int = 9464, host: str = "127.0.0.1"):
+    """在后台线程提供 /metrics（Prometheus 文本）与 /metrics.json"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = to_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(snapshot()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_from_env():
+    """按环境变量开启收集与导出，见模块说明"""
+    path = os.environ.get("BAZI_METRICS_FILE")
+    port = os.environ.get("BAZI_METRICS_PORT")
+    if os.environ.get("BAZI_METRICS", "").lower() in ("1", "true", "yes") or path or port:
+        enable()
+    if path:
+        start_file_exporter(path)
+    if port:
+        start_http_server(int(port))
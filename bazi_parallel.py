@@ -0,0 +1,100 @@
+"""多进程分片排盘
+
+把输入记录切成块，分发到 ProcessPoolExecutor 并按输入顺序产出结果。
+某块处理失败时会重试（工作进程崩溃则重建进程池），
+重试仍失败的记录带 error 字段输出，不会中断整个任务。
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bazi_cli import chart_records, iter_chunks
+import solar_terms
+
+
+def _init_worker():
+    # 每个工作进程只加载一次节气表
+    solar_terms.load_table()
+
+
+def _succeeded(future) -> bool:
+    return future is not None and future.done() and not future.cancelled() and future.exception() is None
+
+
+class ParallelCharter:
+    work = staticmethod(chart_records)   # 在工作进程中处理一块记录的函数
+
+    def __init__(self, workers: int = None, chunk_size: int = 10000, max_retries: int = 2,
+                 default_timezone: str = "Asia/Shanghai"):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.default_timezone = default_timezone
+        self.failed_chunks = 0
+        self._pool = None
+
+    def _submit(self, chunk: list):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        try:
+            return self._pool.submit(self.work, chunk, self.default_timezone)
+        except BrokenProcessPool:
+            self._restart_pool()
+            return self._pool.submit(self.work, chunk, self.default_timezone)
+
+    def _restart_pool(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def _failed_rows(self, chunk: list, error: Exception) -> list:
+        self.failed_chunks += 1
+        return [{"datetime": r.get("datetime"),
+                 "timezone": r.get("timezone") or self.default_timezone,
+                 "error": f"分片处理失败：{error!r}"} for r in chunk]
+
+    def map(self, records):
+        """按块产出排盘结果，顺序与输入一致；同时在途的块数不超过工作进程数的两倍"""
+        pending = deque()
+        chunks = iter_chunks(records, self.chunk_size)
+        try:
+            for chunk in chunks:
+                pending.append([chunk, 0, self._submit(chunk)])
+                if len(pending) >= self.workers * 2:
+                    yield self._collect(pending)
+            while pending:
+                yield self._collect(pending)
+        finally:
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def _collect(self, pending: deque) -> list:
+        # 进程池重建后暂停提交的块，在队首结果确定后统一补交
+        for entry in pending:
+            if entry[2] is None:
+                entry[2] = self._submit(entry[0])
+        while True:
+            entry = pending[0]
+            chunk, attempts, future = entry
+            try:
+                rows = future.result()
+            except Exception as e:
+                if attempts >= self.max_retries:
+                    pending.popleft()
+                    return self._failed_rows(chunk, e)
+                if isinstance(e, BrokenProcessPool):
+                    # 进程池已损坏：重建后先单独重试队首，避免其余块被同一条坏记录连累
+                    self._restart_pool()
+                    for other in pending:
+                        # 已在上一次重建时置空的块无需再处理
+                        if other is not entry and other[2] is not None and not _succeeded(other[2]):
+                            other[2] = None
+                entry[1] += 1
+                entry[2] = self._submit(chunk)
+                continue
+            pending.popleft()
+            return rows
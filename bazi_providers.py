@@ -0,0 +1,218 @@
+"""分析服务注册表
+
+多个 OpenAI 兼容接口按权重轮换使用，每个服务记录最近的首字延迟（流式）或
+响应耗时（非流式），连续失败达到阈值即熔断一段时间，冷却后放行一次试探请求。
+BaziAnalyzer 据此做故障切换与对冲请求：首个服务在其 p95 延迟内没有出字，
+就向下一个服务再发一次，先出字的胜出，另一个被关闭。
+
+配置文件（JSON，默认 ~/.bazi/providers.json，或由环境变量 BAZI_PROVIDERS 指定）：
+    {"providers": [
+        {"name": "siliconflow", "base_url": "https://api.siliconflow.cn/v1",
+         "models": ["deepseek-ai/DeepSeek-R1"], "weight": 2},
+        {"name": "deepseek", "base_url": "https://api.deepseek.com/v1", "api_key": "sk-...",
+         "models": {"deepseek-ai/DeepSeek-R1": "deepseek-reasoner"}}
+     ],
+     "failure_threshold": 3, "cooldown": 30, "hedge_delay": 2.0}
+models 为列表时按原名请求，为字典时把界面上的模型名映射为该服务的模型名；
+省略则接受任意模型。未配置 api_key 的服务使用分析器的密钥。
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import bazi_metrics as metrics
+
+DEFAULT_CONFIG = os.path.join(os.path.expanduser("~"), ".bazi", "providers.json")
+MIN_SAMPLES = 5     # 样本少于此数时使用默认对冲延迟
+
+
+class Provider:
+    def __init__(self, name: str, base_url: str, api_key: str = None, models=(),
+                 weight: float = 1.0, window: int = 100):
+        if weight <= 0:
+            raise ValueError(f"服务 {name} 的权重必须为正数")
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.models = dict(models) if isinstance(models, dict) else {m: m for m in models}
+        self.weight = weight
+        self.latencies = {"ttft": deque(maxlen=window), "response": deque(maxlen=window)}
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0       # 连续失败次数
+        self.opened_at = None   # 熔断开始时刻
+        self.trial = False      # 冷却后已放行试探请求
+
+    def supports(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+    def model_name(self, model: str) -> str:
+        return self.models.get(model, model)
+
+    def percentile(self, kind: str, q: float = 0.95):
+        samples = self.latencies[kind]
+        if len(samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    def stats(self) -> dict:
+        return {"name": self.name, "base_url": self.base_url, "weight": self.weight,
+                "requests": self.requests, "errors": self.errors,
+                "open": self.opened_at is not None,
+                "p95_ttft": self.percentile("ttft"), "p95_response": self.percentile("response")}
+
+
+def is_provider_failure(error) -> bool:
+    """是否应计入熔断：限流、连接失败与服务端错误；其余（如参数错误）换服务也无济于事"""
+    from openai import APIConnectionError, APIError, APIStatusError, RateLimitError
+
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, APIError)
+
+
+class ProviderRegistry:
+    def __init__(self, providers=(), failure_threshold: int = 3, cooldown: float = 30.0,
+                 hedge_delay: float = 2.0, min_hedge_delay: float = 0.05):
+        """hedge_delay 为样本不足时的对冲等待秒数，min_hedge_delay 为下限"""
+        self.providers = []
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_delay_default = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self._lock = threading.Lock()
+        for provider in providers:
+            self.add(provider)
+
+    def add(self, provider: Provider):
+        if any(p.name == provider.name for p in self.providers):
+            raise ValueError(f"服务名称重复：{provider.name}")
+        self.providers.append(provider)
+
+    @classmethod
+    def from_config(cls, path: str) -> "ProviderRegistry":
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        entries = config.get("providers")
+        if not entries:
+            raise ValueError(f"{path} 中没有配置任何服务")
+        providers = [Provider(entry.get("name", entry["base_url"]), entry["base_url"],
+                              entry.get("api_key"), entry.get("models", ()),
+                              entry.get("weight", 1.0)) for entry in entries]
+        options = {k: config[k] for k in ("failure_threshold", "cooldown", "hedge_delay",
+                                          "min_hedge_delay") if k in config}
+        return cls(providers, **options)
+
+    def models(self) -> list:
+        """所有服务支持的模型名（按配置顺序去重）"""
+        return list(dict.fromkeys(m for p in self.providers for m in p.models))
+
+    def _allow(self, provider: Provider, now: float) -> bool:
+        if provider.opened_at is None:
+            return True
+        return now - provider.opened_at >= self.cooldown and not provider.trial
+
+    def candidates(self, model: str) -> list:
+        """按权重随机排序的可用服务；全部熔断时仍返回最早熔断的一个，不至于完全不可用
+
+        只是挑选，不占用试探名额；真正发出请求前须调用 begin。
+        """
+        now = time.monotonic()
+        with self._lock:
+            supporting = [p for p in self.providers if p.supports(model)]
+            allowed = [p for p in supporting if self._allow(p, now)]
+            if not allowed and supporting:
+                allowed = [min(supporting, key=lambda p: p.opened_at)]
+        # 加权无放回抽样：按 u^(1/w) 降序
+        return sorted(allowed, key=lambda p: random.random() ** (1 / p.weight), reverse=True)
+
+    def begin(self, provider: Provider) -> bool:
+        """即将向 provider 发出请求：熔断中的服务占用唯一的试探名额，已被占用时返回 False"""
+        with self._lock:
+            if provider.opened_at is None:
+                return True
+            if provider.trial:
+                return False
+            provider.trial = True
+            return True
+
+    def hedge_delay(self, provider: Provider, stream: bool) -> float:
+        delay = provider.percentile("ttft" if stream else "response")
+        if delay is None:
+            delay = self.hedge_delay_default
+        return max(delay, self.min_hedge_delay)
+
+    def record_success(self, provider: Provider, seconds: float, stream: bool):
+        with self._lock:
+            provider.requests += 1
+            provider.latencies["ttft" if stream else "response"].append(seconds)
+            provider.failures = 0
+            provider.opened_at = None
+            provider.trial = False
+
+    def record_cancel(self, provider: Provider, seconds: float, stream: bool):
+        """对冲落败被取消：不计成败，放回试探名额；已等待的时长作为延迟的下界计入样本，
+        否则总是落败的慢服务永远没有样本，对冲延迟与排序都无从调整"""
+        with self._lock:
+            provider.requests += 1
+            provider.latencies["ttft" if stream else "response"].append(seconds)
+            provider.trial = False
+
+    def record_failure(self, provider: Provider, error) -> bool:
+        """记录一次失败，返回是否因此熔断"""
+        with self._lock:
+            provider.requests += 1
+            provider.errors += 1
+            if not is_provider_failure(error):
+                # 参数错误等说明服务能正常应答，试探请求遇到时也视为恢复
+                provider.failures = 0
+                provider.opened_at = None
+                provider.trial = False
+                return False
+            provider.failures += 1
+            if provider.opened_at is not None:
+                # 试探请求失败，重新计时
+                provider.opened_at = time.monotonic()
+                provider.trial = False
+                return False
+            if provider.failures < self.failure_threshold:
+                return False
+            provider.opened_at = time.monotonic()
+            provider.trial = False
+        metrics.inc("bazi_provider_circuit_open_total")
+        return True
+
+    def stats(self) -> list:
+        with self._lock:
+            return [p.stats() for p in self.providers]
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(base_url: str = None) -> ProviderRegistry:
+    """进程内共享的注册表，使延迟统计与熔断状态跨分析器实例保留
+
+    指定 base_url 时为只含该地址的注册表；否则读取配置文件，
+    没有配置文件时退回 bazi_analysis.BASE_URL。
+    """
+    with _registries_lock:
+        registry = _registries.get(base_url)
+        if registry is None:
+            path = os.environ.get("BAZI_PROVIDERS", DEFAULT_CONFIG)
+            if base_url is None and os.path.exists(path):
+                registry = ProviderRegistry.from_config(path)
+            else:
+                from bazi_analysis import BASE_URL
+
+                url = base_url or BASE_URL
+                registry = ProviderRegistry([Provider(url, url)])
+            _registries[base_url] = registry
+        return registry
@@ -0,0 +1,163 @@
+"""按四柱反查出生时间
+
+给定年、月、日、时柱中的任意几柱，列出时间范围内所有对应的时间区间。
+逐层缩小范围而不逐一排盘：
+    年柱、月柱  由节气表中相邻两个“节”围成的月区间直接给出
+    日柱        当地日期每60天循环一次，时柱天干再约束日干
+    时柱        当地时辰的两小时窗口
+日柱与时柱都按当地时间划分，在UTC偏移不变的片段内分别计算。
+与 BaziCalculator 一样按分钟精度判定，返回的区间为左闭右开的UTC秒。
+
+    search(year="庚午", day="辛亥", hour="壬辰")
+"""
+from datetime import datetime
+from functools import lru_cache
+
+from bazi_core import _DAY_BASE, _EPOCH, _UTC, BaziCalculator, _get_timezone, _transition_table
+import solar_terms
+
+
+def parse_ganzhi(value: str) -> int:
+    """干支转为六十甲子序号（甲子为0）"""
+    if len(value) != 2:
+        raise ValueError(f"无效的干支：{value}")
+    try:
+        gan = BaziCalculator.TIANGAN.index(value[0])
+        zhi = BaziCalculator.DIZHI.index(value[1])
+    except ValueError:
+        raise ValueError(f"无效的干支：{value}")
+    if gan % 2 != zhi % 2:
+        raise ValueError(f"无效的干支：{value}")
+    return (6 * gan - 5 * zhi) % 60
+
+
+@lru_cache(maxsize=None)
+def _month_index():
+    """按“节”划分的月区间：起止UTC秒与年柱、月柱的六十甲子序号"""
+    import numpy as np
+
+    table = np.frombuffer(solar_terms.load_table(), dtype=np.int64)
+    index = np.arange(0, table.size - 1, 2)
+    term = index % 24
+    year = solar_terms.FIRST_YEAR + index // 24 - (term < 2)
+    year_gan, year_zhi = (year - 4) % 10, (year - 4) % 12
+    month_zhi = (term // 2 + 1) % 12
+    month_gan = (year_gan % 5 * 2 + 2 + (month_zhi - 2) % 12) % 10
+    starts = table[index].astype(np.float64)
+    ends = table[np.minimum(index + 2, table.size - 1)].astype(np.float64)
+    return (starts, ends, (6 * year_gan - 5 * year_zhi) % 60,
+            (6 * month_gan - 5 * month_zhi) % 60)
+
+
+def _intersect(a_starts, a_ends, b_starts, b_ends, b_values=None):
+    """两组各自有序且互不重叠的区间求交，可附带 b 区间的取值"""
+    import numpy as np
+
+    first = np.searchsorted(b_ends, a_starts, side="right")
+    last = np.searchsorted(b_starts, a_ends, side="left")
+    counts = np.maximum(last - first, 0)
+    a = np.repeat(np.arange(a_starts.size), counts)
+    b = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    starts = np.maximum(a_starts[a], b_starts[b])
+    ends = np.minimum(a_ends[a], b_ends[b])
+    keep = starts < ends
+    values = None if b_values is None else b_values[b][keep]
+    return starts[keep], ends[keep], values
+
+
+def _to_seconds(value, timezone: str) -> float:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = _get_timezone(timezone).localize(value)
+        return (value - _EPOCH).total_seconds()
+    return float(value)
+
+
+def search_seconds(year: str = None, month: str = None, day: str = None, hour: str = None,
+                   start=None, end=None, timezone: str = "Asia/Shanghai"):
+    """返回匹配区间的 (起点数组, 终点数组)，单位为UTC秒，相邻区间已合并
+
+    start、end 可为UTC秒或 datetime（不带时区时按 timezone 解释），默认为节气表全范围。
+    """
+    import numpy as np
+
+    starts, ends, year_codes, month_codes = _month_index()
+    low = max(starts[0], _to_seconds(start, timezone)) if start is not None else starts[0]
+    high = min(ends[-1], _to_seconds(end, timezone)) if end is not None else ends[-1]
+
+    # 年柱、月柱：筛选月区间
+    keep = np.ones(starts.size, dtype=bool)
+    if year is not None:
+        keep &= year_codes == parse_ganzhi(year)
+    if month is not None:
+        keep &= month_codes == parse_ganzhi(month)
+    starts, ends = np.maximum(starts[keep], low), np.minimum(ends[keep], high)
+    keep = starts < ends
+    starts, ends = starts[keep], ends[keep]
+
+    # 日柱：日干支为 day 的日子；时柱天干另外约束日干（时干 = 日干%5*2 + 时支）
+    allowed = np.ones(60, dtype=bool)
+    if day is not None:
+        allowed &= np.arange(60) == parse_ganzhi(day)
+    if hour is not None:
+        hour_code = parse_ganzhi(hour)
+        hour_gan, hour_zhi = hour_code % 10, hour_code % 12
+        allowed &= np.arange(60) % 10 % 5 * 2 == (hour_gan - hour_zhi) % 10
+    if (day is not None or hour is not None) and starts.size:
+        edges, offsets = _transition_table(timezone)
+        segment_starts = np.concatenate(([-np.inf], edges))
+        segment_ends = np.concatenate((edges, [np.inf]))
+        starts, ends, offset = _intersect(starts, ends, segment_starts, segment_ends, offsets)
+        # 把每个区间展开为其覆盖的当地日（自甲子日起的日数），只保留日干支符合的日子
+        first = np.floor((starts + offset - _DAY_BASE) / 86400).astype(np.int64)
+        counts = np.ceil((ends + offset - _DAY_BASE) / 86400).astype(np.int64) - first
+        owner = np.repeat(np.arange(starts.size), counts)
+        days = np.repeat(first, counts) + (np.arange(counts.sum())
+                                           - np.repeat(np.cumsum(counts) - counts, counts))
+        keep = allowed[days % 60]
+        owner, days = owner[keep], days[keep]
+        offset = offset[owner]
+        day_starts = _DAY_BASE + days * 86400.0 - offset
+        starts = np.maximum(starts[owner], day_starts)
+        ends = np.minimum(ends[owner], day_starts + 86400)
+        keep = starts < ends
+        starts, ends, offset = starts[keep], ends[keep], offset[keep]
+
+    # 时柱：在偏移不变的片段内取当地时辰窗口
+    if hour is not None and starts.size:
+        # 时支 z 对应当地 (2z-1) 点至 (2z+1) 点，每个片段不超过一天，最多与两个窗口相交
+        window = (2 * hour_zhi - 1) * 3600
+        local = starts + offset
+        base = np.floor((local - window) / 86400) * 86400 + window
+        window_starts = np.concatenate((base, base + 86400)) - np.tile(offset, 2)
+        window_ends = window_starts + 7200
+        starts = np.maximum(np.tile(starts, 2), window_starts)
+        ends = np.minimum(np.tile(ends, 2), window_ends)
+        order = np.argsort(starts, kind="stable")
+        starts, ends = starts[order], ends[order]
+
+    # 按分钟精度判定：分钟起点落在区间内的整分钟都匹配
+    starts = np.ceil(starts / 60) * 60
+    ends = np.ceil(ends / 60) * 60
+    keep = starts < ends
+    starts, ends = starts[keep], ends[keep]
+    if starts.size:
+        # 合并首尾相接的区间
+        heads = np.flatnonzero(np.concatenate(([True], starts[1:] > ends[:-1])))
+        starts, ends = starts[heads], np.maximum.reduceat(ends, heads)
+    return starts.astype(np.int64), ends.astype(np.int64)
+
+
+def search(year: str = None, month: str = None, day: str = None, hour: str = None,
+           start=None, end=None, timezone: str = "Asia/Shanghai") -> list:
+    """返回匹配区间的 [(起, 止)] 列表，均为 timezone 时区的 datetime，止点不含"""
+    tzinfo = _get_timezone(timezone)
+    starts, ends = search_seconds(year, month, day, hour, start, end, timezone)
+    return [(datetime.fromtimestamp(s, _UTC).astimezone(tzinfo),
+             datetime.fromtimestamp(e, _UTC).astimezone(tzinfo))
+            for s, e in zip(starts.tolist(), ends.tolist())]
+
+
+if __name__ == "__main__":
+    for begin, finish in search(year="庚午", month="丁亥", day="辛亥", hour="壬辰"):
+        print(begin, "-", finish)
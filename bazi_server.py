@@ -0,0 +1,412 @@
+"""排盘与分析 HTTP 服务
+
+基于 asyncio 的单进程服务，连接保持（keep-alive）：
+    GET/POST /chart    排盘，记录字段同 bazi_cli（datetime、timezone、lunar、leap）
+    POST /analyze      分析命盘，请求体为 {"report": ...} 或排盘记录；
+                       带 ?stream=1 或 Accept: text/event-stream 时以 SSE 流式返回
+    GET /health        运行状态与批处理统计
+    GET /metrics       埋点数据（Prometheus 文本，需开启 bazi_metrics）
+短时间内到达的排盘请求合并为一次向量化计算（见 ChartBatcher）。
+
+    python bazi_server.py --port 8080 --api-key sk-...
+    python bazi_server.py --load-test --requests 20000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import bazi_metrics as metrics
+from bazi_cli import chart_records, row_to_record
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+MAX_BODY = 1 << 20
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ChartBatcher:
+    """把 window 秒内到达的排盘请求合并成一批，满 max_batch 条时立即计算"""
+
+    def __init__(self, window: float = 0.002, max_batch: int = 512,
+                 default_timezone: str = "Asia/Shanghai"):
+        self.window = window
+        self.max_batch = max_batch
+        self.default_timezone = default_timezone
+        self.batches = 0
+        self.records = 0
+        self._pending = []
+        self._timer = None
+
+    async def chart(self, record: dict) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((record, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            rows = chart_records([record for record, _ in pending], self.default_timezone)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.records += len(rows)
+        metrics.observe("bazi_chart_batch_size", len(rows), metrics.RATE_BUCKETS)
+        for (_, future), row in zip(pending, rows):
+            if not future.done():
+                future.set_result(row_to_record(row))
+
+
+class Request:
+    def __init__(self, method: str, target: str, version: str, headers: dict, body: bytes):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = dict(parse_qsl(parts.query))
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self) -> dict:
+        if not self.body:
+            return {}
+        try:
+            payload = json.loads(self.body)
+        except ValueError:
+            raise HTTPError(400, "请求体不是有效的JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "请求体应为JSON对象")
+        return payload
+
+
+async def _read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "无效的请求行")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HTTPError(400, "无效的 Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "请求体过大")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, target, version, headers, body)
+
+
+def _head(status: int, content_type: str, keep_alive: bool, length: int = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+             f"Content-Type: {content_type}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    if length is None:
+        lines += ["Transfer-Encoding: chunked", "Cache-Control: no-cache"]
+    else:
+        lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class BaziServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, analyzer=None,
+                 batch_window: float = 0.002, max_batch: int = 512,
+                 default_timezone: str = "Asia/Shanghai", idle_timeout: float = 30.0):
+        """analyzer 为 AsyncBaziAnalyzer，未提供时 /analyze 返回 503"""
+        self.host = host
+        self.port = port
+        self.analyzer = analyzer
+        self.idle_timeout = idle_timeout
+        self.batcher = ChartBatcher(batch_window, max_batch, default_timezone)
+        self.requests = 0
+        self.connections = 0
+        self._started = time.monotonic()
+        self._server = None
+
+    @property
+    def address(self) -> tuple:
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def start(self) -> "BaziServer":
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        if self.analyzer is not None:
+            await self.analyzer.aclose()
+            if self.analyzer.cache is not None:
+                self.analyzer.cache.close()
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), self.idle_timeout)
+                except HTTPError as e:
+                    await self._send_json(writer, e.status, {"error": e.message}, False)
+                    return
+                if request is None:
+                    return
+                self.requests += 1
+                keep_alive = request.keep_alive
+                try:
+                    if await self._dispatch(request, writer, keep_alive) is False:
+                        return
+                except HTTPError as e:
+                    await self._send_json(writer, e.status, {"error": e.message}, keep_alive)
+                except Exception as e:
+                    await self._send_json(writer, 500, {"error": f"未知错误：{e}"}, False)
+                    return
+                if not keep_alive:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_json(self, writer, status: int, payload: dict, keep_alive: bool):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(_head(status, "application/json; charset=utf-8", keep_alive, len(body)) + body)
+        await writer.drain()
+
+    async def _dispatch(self, request: Request, writer, keep_alive: bool):
+        """返回 False 时响应已中途结束，须关闭连接"""
+        if request.path == "/chart":
+            if request.method == "GET":
+                record = request.query
+            elif request.method == "POST":
+                record = request.json()
+            else:
+                raise HTTPError(405, "仅支持 GET 或 POST")
+            result = await self.batcher.chart(record)
+            await self._send_json(writer, 400 if "error" in result else 200, result, keep_alive)
+        elif request.path == "/analyze":
+            if request.method != "POST":
+                raise HTTPError(405, "仅支持 POST")
+            return await self._analyze(request, writer, keep_alive)
+        elif request.path == "/health":
+            await self._send_json(writer, 200, self.stats(), keep_alive)
+        elif request.path == "/metrics":
+            body = metrics.to_prometheus().encode("utf-8")
+            writer.write(_head(200, "text/plain; version=0.0.4", keep_alive, len(body)) + body)
+            await writer.drain()
+        else:
+            raise HTTPError(404, "未知路径")
+
+    async def _analyze(self, request: Request, writer, keep_alive: bool):
+        if self.analyzer is None:
+            raise HTTPError(503, "未配置分析服务（需要 API 密钥）")
+        payload = request.json()
+        report = payload.get("report")
+        if report is None:
+            charted = await self.batcher.chart(payload)
+            if "error" in charted:
+                raise HTTPError(400, charted["error"])
+            report = {"sizhu": charted["sizhu"], "wuxing": charted["wuxing"]}
+
+        stream = (request.query.get("stream") in ("1", "true")
+                  or "text/event-stream" in request.headers.get("accept", ""))
+        if not stream:
+            content = await self.analyzer.analyze(report)
+            await self._send_json(writer, 200, {"report": report, "content": content}, keep_alive)
+            return
+
+        writer.write(_head(200, "text/event-stream; charset=utf-8", keep_alive))
+        sections = []
+        chunks = self.analyzer.analyze_stream(report, on_section=sections.append)
+        try:
+            async for chunk in chunks:
+                self._write_chunk(writer, "data: " + json.dumps({"content": chunk},
+                                                                ensure_ascii=False) + "\n\n")
+                self._write_sections(writer, sections)
+                await writer.drain()
+            self._write_sections(writer, sections)
+            self._write_chunk(writer, "data: [DONE]\n\n")
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # 响应头已发出，不能再返回 500：以 error 事件结束分块正文并关闭连接
+            self._write_chunk(writer, "event: error\ndata: " + json.dumps(
+                {"error": f"未知错误：{e}"}, ensure_ascii=False) + "\n\n")
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            return False
+        finally:
+            # 客户端断开时关闭上游流，不再消耗 token
+            await chunks.aclose()
+
+    @classmethod
+    def _write_sections(cls, writer, sections: list):
+        """每节完整到达时另发一条 section 事件，客户端可提前按节渲染"""
+        for section in sections:
+            cls._write_chunk(writer, "event: section\ndata: " + json.dumps(
+                section._asdict(), ensure_ascii=False) + "\n\n")
+        sections.clear()
+
+    @staticmethod
+    def _write_chunk(writer, text: str):
+        data = text.encode("utf-8")
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def stats(self) -> dict:
+        batches = self.batcher.batches
+        return {
+            "status": "ok",
+            "uptime": time.monotonic() - self._started,
+            "requests": self.requests,
+            "connections": self.connections,
+            "chart_batches": batches,
+            "charted_records": self.batcher.records,
+            "mean_batch_size": self.batcher.records / batches if batches else 0.0,
+            "providers": self.analyzer.providers.stats() if self.analyzer is not None else [],
+        }
+
+
+async def load_test(host: str, port: int, requests: int = 10000, concurrency: int = 64) -> dict:
+    """以 concurrency 条保持连接并发请求 GET /chart，返回吞吐与延迟分位"""
+    import random
+
+    latencies = []
+    per_connection = [requests // concurrency + (i < requests % concurrency)
+                      for i in range(concurrency)]
+
+    async def worker(count: int, seed: int):
+        rng = random.Random(seed)
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for _ in range(count):
+                stamp = (f"{rng.randint(1950, 2049)}-{rng.randint(1, 12):02d}-"
+                         f"{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}")
+                start = time.perf_counter()
+                writer.write(f"GET /chart?datetime={stamp} HTTP/1.1\r\nHost: {host}\r\n\r\n"
+                             .encode("latin-1"))
+                await writer.drain()
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(count, i) for i, count in enumerate(per_connection) if count))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def _main(args):
+    analyzer = None
+    api_key = args.api_key or os.environ.get("BAZI_API_KEY")
+    if api_key:
+        from bazi_analysis import AsyncBaziAnalyzer
+        providers = None
+        if args.providers:
+            from bazi_providers import ProviderRegistry
+            providers = ProviderRegistry.from_config(args.providers)
+        cache = None
+        if not args.no_cache:
+            from bazi_cache import DEFAULT_PATH, ResponseCache
+            cache = ResponseCache(args.cache or DEFAULT_PATH)
+        analyzer = AsyncBaziAnalyzer(api_key, base_url=args.base_url, providers=providers,
+                                     cache=cache)
+    server = BaziServer(args.host, args.port, analyzer, args.batch_window / 1000,
+                        args.max_batch, args.timezone)
+    await server.start()
+    host, port = server.address
+    if not args.load_test:
+        print(f"服务已启动：http://{host}:{port}", file=sys.stderr)
+        await server.serve_forever()
+        return
+    result = await load_test(host, port, args.requests, args.concurrency)
+    result.update({k: v for k, v in server.stats().items() if k in ("chart_batches", "mean_batch_size")})
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    await server.close()
+
+
+def main(argv=None):
+    metrics.configure_from_env()
+    parser = argparse.ArgumentParser(description="八字排盘与分析 HTTP 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--api-key", help="分析接口密钥，默认读取环境变量 BAZI_API_KEY")
+    parser.add_argument("--base-url", help="分析接口地址")
+    parser.add_argument("--providers", help="多服务配置文件（见 bazi_providers），默认读取 BAZI_PROVIDERS")
+    parser.add_argument("--cache", help="分析结果缓存文件，默认 ~/.bazi/analysis_cache.sqlite3")
+    parser.add_argument("--no-cache", action="store_true", help="不缓存分析结果")
+    parser.add_argument("--timezone", default="Asia/Shanghai", help="记录未指定时区时使用")
+    parser.add_argument("--batch-window", type=float, default=2.0, help="排盘请求合并窗口（毫秒）")
+    parser.add_argument("--max-batch", type=int, default=512)
+    parser.add_argument("--load-test", action="store_true", help="在随机端口启动服务并压测 /chart")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args(argv)
+    if args.load_test:
+        args.port = 0
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
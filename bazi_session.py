@@ -0,0 +1,212 @@
+"""会话持久化
+
+每个会话对应一次排盘：命盘报告与逐条对话写入 SQLite（WAL 模式），
+每条消息产生时即单独提交，程序退出或崩溃都不丢失已有对话。
+恢复时按索引只读取最近若干条，更早的内容由压缩生成的摘要代替；
+全文检索使用 FTS5 三元组索引（不可用时退回 LIKE 查询）。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".bazi", "sessions.sqlite3")
+ROLE_ERROR = "error"
+
+
+class SessionStore:
+    def __init__(self, path: str = DEFAULT_PATH, excerpt_chars: int = 40,
+                 summary_lines: int = 50):
+        """summary_lines 为压缩后每个会话保留的摘要行数上限"""
+        self.path = path
+        self.excerpt_chars = excerpt_chars
+        self.summary_lines = summary_lines
+        self._lock = threading.Lock()
+        self._compactor = None
+        self._stop = threading.Event()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 NORMAL 即可保证崩溃后数据库一致，逐条提交的开销小得多
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY, report TEXT, summary TEXT NOT NULL DEFAULT '',
+                created REAL NOT NULL, updated REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated);
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY, session_id INTEGER NOT NULL,
+                role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS turns_session ON turns(session_id, id);
+        """)
+        self.fts = self._create_fts()
+        self._db.commit()
+
+    def _create_fts(self) -> bool:
+        try:
+            self._db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+                    content, content='turns', content_rowid='id', tokenize='trigram');
+                CREATE TRIGGER IF NOT EXISTS turns_ai AFTER INSERT ON turns BEGIN
+                    INSERT INTO turns_fts(rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS turns_ad AFTER DELETE ON turns BEGIN
+                    INSERT INTO turns_fts(turns_fts, rowid, content)
+                    VALUES ('delete', old.id, old.content);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def create_session(self, report: dict = None) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO sessions (report, created, updated) VALUES (?, ?, ?)",
+                (None if report is None else json.dumps(report, ensure_ascii=False), now, now))
+            self._db.commit()
+            return cursor.lastrowid
+
+    def append(self, session_id: int, role: str, content: str) -> int:
+        """追加一条消息并立即提交，role 为 user、assistant 或 error"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO turns (session_id, role, content, created) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, now))
+            self._db.execute("UPDATE sessions SET updated = ? WHERE id = ?", (now, session_id))
+            self._db.commit()
+            return cursor.lastrowid
+
+    def latest_session(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM sessions ORDER BY updated DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def load(self, session_id: int, limit: int = 200) -> dict:
+        """读取会话：命盘、摘要与最近 limit 条消息（按时间顺序）"""
+        with self._lock:
+            row = self._db.execute("SELECT report, summary FROM sessions WHERE id = ?",
+                                   (session_id,)).fetchone()
+            if row is None:
+                raise KeyError(session_id)
+            turns = self._db.execute(
+                "SELECT role, content FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)).fetchall()
+            total = self._db.execute("SELECT COUNT(*) FROM turns WHERE session_id = ?",
+                                     (session_id,)).fetchone()[0]
+        turns.reverse()
+        return {
+            "id": session_id,
+            "report": None if row[0] is None else json.loads(row[0]),
+            "summary": row[1].splitlines() if row[1] else [],
+            "turns": [{"role": role, "content": content} for role, content in turns],
+            "omitted": total - len(turns),
+        }
+
+    def sessions(self, limit: int = 20) -> list:
+        with self._lock:
+            rows = self._db.execute("""
+                SELECT s.id, s.report, s.created, s.updated,
+                       (SELECT COUNT(*) FROM turns t WHERE t.session_id = s.id)
+                FROM sessions s ORDER BY s.updated DESC LIMIT ?""", (limit,)).fetchall()
+        return [{"id": r[0], "report": None if r[1] is None else json.loads(r[1]),
+                 "created": r[2], "updated": r[3], "turns": r[4]} for r in rows]
+
+    def search(self, text: str, session_id: int = None, limit: int = 50) -> list:
+        """全文检索消息，返回最新的 limit 条匹配"""
+        # 三元组索引只能匹配不少于3个字符的片段
+        if self.fts and len(text) >= 3:
+            query = ("SELECT t.id, t.session_id, t.role, t.content, t.created FROM turns_fts f "
+                     "JOIN turns t ON t.id = f.rowid WHERE turns_fts MATCH ?")
+            params = ['"' + text.replace('"', '""') + '"']
+        else:
+            query = ("SELECT id, session_id, role, content, created FROM turns t "
+                     "WHERE content LIKE ? ESCAPE '\\'")
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params = [f"%{escaped}%"]
+        if session_id is not None:
+            query += " AND t.session_id = ?"
+            params.append(session_id)
+        query += " ORDER BY t.id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [{"id": r[0], "session_id": r[1], "role": r[2], "content": r[3], "created": r[4]}
+                for r in rows]
+
+    def _excerpt(self, role: str, content: str) -> str:
+        label = {"user": "问", "assistant": "答"}.get(role, "错")
+        text = " ".join(content.split())
+        if len(text) > self.excerpt_chars:
+            text = text[:self.excerpt_chars] + "…"
+        return f"{label}：{text}"
+
+    def compact(self, max_age: float = 7 * 86400, keep_recent: int = 20,
+                max_sessions: int = 1000) -> dict:
+        """压缩超过 max_age 秒未更新的会话：只保留最近 keep_recent 条消息，
+        更早的并入摘要；会话数超过 max_sessions 时删除最旧的会话"""
+        cutoff = time.time() - max_age
+        stats = {"sessions": 0, "turns": 0, "deleted_sessions": 0}
+        with self._lock:
+            candidates = self._db.execute("""
+                SELECT s.id, s.summary FROM sessions s WHERE s.updated < ?
+                AND (SELECT COUNT(*) FROM turns t WHERE t.session_id = s.id) > ?""",
+                                          (cutoff, keep_recent)).fetchall()
+        for session_id, summary in candidates:
+            if self._stop.is_set():
+                break
+            # 每个会话单独一个事务，避免长时间占用锁
+            with self._lock:
+                old = self._db.execute("""
+                    SELECT id, role, content FROM turns WHERE session_id = ?
+                    ORDER BY id DESC LIMIT -1 OFFSET ?""", (session_id, keep_recent)).fetchall()
+                if not old:
+                    continue
+                old.reverse()
+                lines = (summary.splitlines() if summary else [])
+                lines += [self._excerpt(role, content) for _, role, content in old
+                          if role != ROLE_ERROR]
+                self._db.execute("UPDATE sessions SET summary = ? WHERE id = ?",
+                                 ("\n".join(lines[-self.summary_lines:]), session_id))
+                self._db.execute("DELETE FROM turns WHERE session_id = ? AND id <= ?",
+                                 (session_id, old[-1][0]))
+                self._db.commit()
+            stats["sessions"] += 1
+            stats["turns"] += len(old)
+
+        with self._lock:
+            stale = [row[0] for row in self._db.execute(
+                "SELECT id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?",
+                (max_sessions,))]
+            for session_id in stale:
+                self._db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        stats["deleted_sessions"] = len(stale)
+        return stats
+
+    def start_compaction(self, interval: float = 3600, **kwargs):
+        """后台线程定期压缩，参数同 compact"""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.compact(**kwargs)
+                except sqlite3.Error:
+                    pass
+                if self._stop.wait(interval):
+                    return
+
+        if self._compactor is None:
+            self._compactor = threading.Thread(target=loop, daemon=True)
+            self._compactor.start()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,232 @@
+"""批量命盘统计
+
+对整数编码的命盘（generate_batch 的结果或 Chart 打包字节）做 bincount 聚合，
+得到五行分布、各柱干支频数与交叉表。统计量按块累加、可合并，
+内存只与块大小有关：
+
+    stats = ChartStats()
+    for chunk in chunks:
+        stats.update_batch(generate_batch(chunk))
+    print(stats.report())
+
+命令行：python bazi_stats.py births.csv        （出生记录，字段同 bazi_cli）
+        python bazi_stats.py charts.bin --packed（Chart.pack_many 写出的文件）
+"""
+import argparse
+import io
+import json
+import sys
+import time
+from itertools import combinations
+
+from bazi_core import ELEMENTS, PILLARS, BaziCalculator, Chart, generate_batch
+
+_GANZHI = [BaziCalculator.TIANGAN[i % 10] + BaziCalculator.DIZHI[i % 12] for i in range(60)]
+# 五行计数向量编码为 5 进制整数（每项 0-4）
+_PROFILE_SIZE = 5 ** len(ELEMENTS)
+
+
+def _branch_elements():
+    import numpy as np
+
+    return np.array([ELEMENTS.index(BaziCalculator.ELEMENT_MAP[zhi])
+                     for zhi in BaziCalculator.DIZHI], dtype=np.intp)
+
+
+class ChartStats:
+    def __init__(self):
+        import numpy as np
+
+        self.count = 0
+        # 各柱六十甲子频数，行序见 PILLARS
+        self.pillars = np.zeros((len(PILLARS), 60), dtype=np.int64)
+        # 五行计数向量的分布（与 get_wuxing_strength 一致，只计天干）
+        self.profiles = np.zeros(_PROFILE_SIZE, dtype=np.int64)
+        # 天干与地支合计的五行个数
+        self.elements_all = np.zeros(len(ELEMENTS), dtype=np.int64)
+        # 两两柱之间的 60x60 交叉表
+        self.pairs = {pair: np.zeros((60, 60), dtype=np.int64)
+                      for pair in combinations(range(len(PILLARS)), 2)}
+        self._branch_elements = _branch_elements()
+        self._profile_weights = 5 ** np.arange(len(ELEMENTS))
+
+    def update(self, stem, branch):
+        """累加一块命盘，stem、branch 为 (N, 4) 的天干、地支下标"""
+        import numpy as np
+
+        stem = np.asarray(stem, dtype=np.intp)
+        branch = np.asarray(branch, dtype=np.intp)
+        n = stem.shape[0]
+        if not n:
+            return
+        codes = (6 * stem - 5 * branch) % 60
+        offsets = np.arange(len(PILLARS)) * 60
+        self.pillars += np.bincount((codes + offsets).ravel(),
+                                    minlength=self.pillars.size).reshape(self.pillars.shape)
+        for (a, b), table in self.pairs.items():
+            table += np.bincount(codes[:, a] * 60 + codes[:, b], minlength=3600).reshape(60, 60)
+
+        # 天干下标整除2即为五行下标；各柱的 5**五行 相加即为计数向量的编码
+        stem_elements = stem // 2
+        profile = self._profile_weights[stem_elements].sum(axis=1)
+        self.profiles += np.bincount(profile, minlength=_PROFILE_SIZE)
+        self.elements_all += np.bincount(
+            np.concatenate((stem_elements.ravel(), self._branch_elements[branch].ravel())),
+            minlength=len(ELEMENTS))
+        self.count += n
+
+    def update_batch(self, batch: dict):
+        self.update(batch["stem"], batch["branch"])
+
+    def update_packed(self, packed):
+        """累加 Chart 打包格式的命盘（(N, 8) uint8 数组或字节串）"""
+        import numpy as np
+
+        if isinstance(packed, (bytes, bytearray, memoryview)):
+            packed = np.frombuffer(packed, dtype=np.uint8)
+        packed = np.asarray(packed, dtype=np.uint8).reshape(-1, Chart.size)
+        self.update(packed[:, :4] >> 4, packed[:, :4] & 0xF)
+
+    def merge(self, other: "ChartStats"):
+        self.count += other.count
+        self.pillars += other.pillars
+        self.profiles += other.profiles
+        self.elements_all += other.elements_all
+        for pair, table in other.pairs.items():
+            self.pairs[pair] += table
+
+    def element_counts(self):
+        """(5, 5) 数组：第 i 行为五行 i 的个数恰为 0-4 的命盘数"""
+        import numpy as np
+
+        profiles = np.arange(_PROFILE_SIZE)
+        counts = np.zeros((len(ELEMENTS), 5), dtype=np.int64)
+        for i in range(len(ELEMENTS)):
+            counts[i] = np.bincount(profiles // 5 ** i % 5, weights=self.profiles,
+                                    minlength=5).astype(np.int64)
+        return counts
+
+    def element_distribution(self) -> dict:
+        counts = self.element_counts()
+        total = max(self.count, 1)
+        return {
+            element: {
+                "total": int(counts[i] @ range(5)),
+                "mean": float(counts[i] @ range(5)) / total,
+                "missing": int(counts[i, 0]),
+                "missing_share": float(counts[i, 0]) / total,
+                "with_branches": int(self.elements_all[i]),
+            }
+            for i, element in enumerate(ELEMENTS)
+        }
+
+    def pillar_table(self, pillar: str) -> dict:
+        """某柱的干支频数，按六十甲子顺序"""
+        row = self.pillars[PILLARS.index(pillar)]
+        return {_GANZHI[i]: int(row[i]) for i in range(60) if row[i]}
+
+    def crosstab(self, first: str, second: str):
+        """两柱之间的 60x60 交叉表，行列均按六十甲子顺序"""
+        a, b = PILLARS.index(first), PILLARS.index(second)
+        return self.pairs[(a, b)] if a < b else self.pairs[(b, a)].T
+
+    def report(self, top: int = 10) -> dict:
+        import numpy as np
+
+        profiles = np.flatnonzero(self.profiles)
+        profiles = profiles[np.argsort(-self.profiles[profiles], kind="stable")][:top]
+        return {
+            "count": self.count,
+            "wuxing": self.element_distribution(),
+            "wuxing_profiles": [
+                {"wuxing": {e: int(code // 5 ** i % 5) for i, e in enumerate(ELEMENTS)},
+                 "count": int(self.profiles[code])}
+                for code in profiles
+            ],
+            "pillars": {
+                pillar: [{"ganzhi": _GANZHI[i], "count": int(row[i])}
+                         for i in np.argsort(-row, kind="stable")[:top] if row[i]]
+                for pillar, row in zip(PILLARS, self.pillars)
+            },
+        }
+
+
+def summarize_timestamps(chunks, timezone: str = "Asia/Shanghai") -> ChartStats:
+    """逐块统计UTC时间戳（秒）"""
+    stats = ChartStats()
+    for chunk in chunks:
+        stats.update_batch(generate_batch(chunk, timezone))
+    return stats
+
+
+def summarize_packed(path: str, chunk_size: int = 1_000_000) -> ChartStats:
+    """逐块统计 Chart 打包文件，经内存映射读取"""
+    import numpy as np
+
+    stats = ChartStats()
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    if data.size % Chart.size:
+        raise ValueError("文件长度不是命盘大小的整数倍")
+    data = data.reshape(-1, Chart.size)
+    for start in range(0, data.shape[0], chunk_size):
+        stats.update_packed(data[start:start + chunk_size])
+    return stats
+
+
+def summarize_records(records, chunk_size: int = 100000,
+                      default_timezone: str = "Asia/Shanghai") -> tuple:
+    """逐块统计出生记录，返回 (统计, 无效记录数)"""
+    from bazi_cli import encode_records, iter_chunks
+
+    stats, errors = ChartStats(), 0
+    for chunk in iter_chunks(records, chunk_size):
+        rows, charted, batch = encode_records(chunk, default_timezone)
+        errors += len(rows) - len(charted)
+        if batch is not None:
+            stats.update_batch(batch)
+    return stats, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量命盘五行与干支统计")
+    parser.add_argument("input", nargs="?", default="-", help="输入文件，默认标准输入")
+    parser.add_argument("-o", "--output", help="统计结果写入JSON文件，默认标准输出")
+    parser.add_argument("--packed", action="store_true", help="输入为 Chart 打包文件")
+    parser.add_argument("--input-format", choices=["csv", "jsonl"])
+    parser.add_argument("--timezone", default="Asia/Shanghai", help="记录未指定时区时使用")
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--top", type=int, default=10, help="频数表保留前N项")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    errors = 0
+    if args.packed:
+        stats = summarize_packed(args.input, args.chunk_size)
+    else:
+        from bazi_cli import _detect_format, read_records
+        fmt = _detect_format(args.input, args.input_format, "jsonl")
+        if args.input == "-":
+            source = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+        else:
+            source = open(args.input, encoding="utf-8", newline="")
+        try:
+            stats, errors = summarize_records(read_records(source, fmt), args.chunk_size,
+                                              args.timezone)
+        finally:
+            if args.input != "-":
+                source.close()
+
+    report = stats.report(args.top)
+    report["errors"] = errors
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    elapsed = time.perf_counter() - start
+    print(f"已统计 {stats.count} 个命盘（无效 {errors} 条），耗时 {elapsed:.2f} 秒", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
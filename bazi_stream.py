@@ -0,0 +1,154 @@
+"""流式输出的增量处理
+
+模型回答按 _build_messages 的要求以“🔹”分点。StreamProcessor 逐块接收
+正文与推理内容（R1 的 reasoning_content），用列表累积而不反复拼接字符串，
+每当下一个“🔹”到达即把上一节解析为 Section，流结束前就能逐节渲染或保存。
+StreamingAnalysis 把它包装成可迭代对象：迭代得到正文片段，结束后 result() 给出完整结果。
+"""
+from collections import namedtuple
+
+BULLET = "🔹"
+STRENGTH_MARKS = ("✅", "✔", "√")
+CAUTION_MARKS = ("❌", "✖", "×")
+
+Section = namedtuple("Section", ["index", "title", "text", "strengths", "cautions"])
+AnalysisResult = namedtuple("AnalysisResult", ["content", "reasoning", "preamble", "sections"])
+
+
+def _make_section(index: int, text: str) -> Section:
+    text = text.strip()
+    first_line = text.split("\n", 1)[0]
+    for separator in ("：", ":"):
+        if separator in first_line:
+            title = first_line.split(separator, 1)[0]
+            break
+    else:
+        title = first_line
+    lines = [line.strip() for line in text.splitlines()]
+    return Section(index, title.strip(), text,
+                   [line for line in lines if line.startswith(STRENGTH_MARKS)],
+                   [line for line in lines if line.startswith(CAUTION_MARKS)])
+
+
+def parse_sections(text: str) -> AnalysisResult:
+    """一次性解析完整回答（非流式响应或缓存内容）"""
+    processor = StreamProcessor()
+    processor.feed(text)
+    return processor.finish()
+
+
+class StreamProcessor:
+    def __init__(self, on_section=None):
+        """on_section(section) 在每节完整到达时调用"""
+        self.on_section = on_section
+        self.sections = []
+        self._content = []
+        self._reasoning = []
+        self._current = []      # 当前节（或首个“🔹”之前的引言）尚未结束的片段
+        self._preamble = None
+        self._result = None
+
+    @property
+    def content(self) -> str:
+        return "".join(self._content)
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self._reasoning)
+
+    def feed(self, content: str = None, reasoning: str = None) -> list:
+        """接收一块输出，返回因此完整的新节"""
+        if reasoning:
+            self._reasoning.append(reasoning)
+        if not content:
+            return []
+        self._content.append(content)
+        if BULLET not in content:
+            self._current.append(content)
+            return []
+        completed = []
+        head, *rest = content.split(BULLET)
+        self._current.append(head)
+        for part in rest:
+            section = self._close_current()
+            if section is not None:
+                completed.append(section)
+            self._current = [part]
+        return completed
+
+    def _close_current(self):
+        text = "".join(self._current)
+        if self._preamble is None:
+            self._preamble = text.strip()
+            return None
+        section = _make_section(len(self.sections), text)
+        self.sections.append(section)
+        if self.on_section is not None:
+            self.on_section(section)
+        return section
+
+    def finish(self) -> AnalysisResult:
+        if self._result is None:
+            self._close_current()
+            self._current = []
+            self._result = AnalysisResult(self.content, self.reasoning, self._preamble or "",
+                                          list(self.sections))
+        return self._result
+
+
+class StreamingAnalysis:
+    """可迭代的流式分析：逐块给出正文，同时累积推理内容并分节
+
+    deltas 为 (正文, 推理) 二元组的可迭代对象；完整结束后以结果调用 on_complete，
+    无论是否迭代完都会调用 close（用于释放HTTP连接）。只能迭代一遍：
+    多次 iter() 得到同一个迭代器，从中断处继续。
+    """
+
+    def __init__(self, deltas, on_section=None, on_complete=None, close=None):
+        self.processor = StreamProcessor(on_section)
+        self.done = False
+        self._deltas = deltas
+        self._on_complete = on_complete
+        self._close = close
+        self._iterator = self._iterate()
+
+    @property
+    def sections(self) -> list:
+        return self.processor.sections
+
+    @property
+    def reasoning(self) -> str:
+        return self.processor.reasoning
+
+    def __iter__(self):
+        return self._iterator
+
+    def close(self):
+        """提前结束并释放连接"""
+        from inspect import GEN_CREATED, getgeneratorstate
+
+        if getgeneratorstate(self._iterator) == GEN_CREATED and self._close is not None:
+            # 尚未开始迭代时关闭生成器不会执行其 finally
+            self._close()
+        self._iterator.close()
+
+    def _iterate(self):
+        try:
+            for content, reasoning in self._deltas:
+                self.processor.feed(content, reasoning)
+                if content:
+                    yield content
+            result = self.processor.finish()
+            self.done = True
+            if self._on_complete is not None:
+                self._on_complete(result)
+        finally:
+            if self._close is not None:
+                self._close()
+
+    def result(self) -> AnalysisResult:
+        """读完剩余输出并返回完整结果"""
+        if not self.done:
+            for _ in self._iterator:
+                pass
+        return self.processor.finish()
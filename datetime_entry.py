@@ -1,9 +1,8 @@
 import tkinter as tk
 from tkinter import ttk
-from tkcalendar import Calendar
-from datetime import datetime
-import pytz
-from lunardate import LunarDate
+from datetime import date, datetime
+import bazi_lunar
+# tkcalendar、pytz 在首次使用时才导入，避免拖慢启动
 
 class DateTimeEntry(ttk.Frame):
     """增强版日期时间输入组件"""
@@ -19,6 +18,9 @@ class DateTimeEntry(ttk.Frame):
         super().__init__(master)
         self.date_type = tk.StringVar(value='公历')  # 公历/农历
         self.selected_date = None
+        # 由公历转换得到的农历年月日：农历二月廿九、三十等无法作为公历日期选中，另行保存并显示
+        self.lunar_date = None
+        self.is_leap_month = False  # 农历模式下所选月份是否为闰月
         self._create_widgets()
 
     def _create_widgets(self):
@@ -31,9 +33,11 @@ class DateTimeEntry(ttk.Frame):
                        value='农历', command=self._update_calendar).grid(row=0, column=2)
 
         # 日期选择器
+        from tkcalendar import Calendar
         self.cal = Calendar(self, selectmode='day', year=2000, month=1, day=1,
                           date_pattern='y-mm-dd', locale='zh_CN')
         self.cal.grid(row=1, column=0, columnspan=4, pady=5)
+        self.cal.bind("<<CalendarSelected>>", self._on_date_selected)
 
         # 时间输入
         ttk.Label(self, text="时间 (HH:MM):").grid(row=2, column=0)
@@ -49,9 +53,26 @@ class DateTimeEntry(ttk.Frame):
 
         # 日期转换按钮
         ttk.Button(self, text="转换公历/农历", command=self._convert_date).grid(row=4, column=0, columnspan=2)
+        self.lunar_label = ttk.Label(self, text="")
+        self.lunar_label.grid(row=4, column=2, columnspan=2)
+
+    def _set_lunar(self, lunar_date, leap: bool = False):
+        """记录转换得到的农历日期（None 表示以日历选中的年月日为准）"""
+        self.lunar_date = lunar_date
+        self.is_leap_month = leap
+        if lunar_date is None:
+            self.lunar_label.config(text="")
+        else:
+            year, month, day = lunar_date
+            self.lunar_label.config(text=f"农历 {year}年{'闰' if leap else ''}{month}月{day}日")
+
+    def _on_date_selected(self, event=None):
+        """重新选择日期后，此前转换得到的农历日期与闰月标记都不再适用"""
+        self._set_lunar(None)
 
     def _update_calendar(self):
         """切换日历类型"""
+        self._set_lunar(None)
         if self.date_type.get() == '农历':
             self._show_lunar_calendar()
         else:
@@ -65,29 +86,36 @@ class DateTimeEntry(ttk.Frame):
     def _convert_date(self):
         """公历农历转换"""
         try:
+            year, month, day = self._parse_date()
             if self.date_type.get() == '公历':
-                solar_date = self.get_datetime().date()
-                lunar_date = LunarDate.fromSolarDate(solar_date.year, solar_date.month, solar_date.day)
+                lunar = bazi_lunar.from_solar(date(year, month, day))
+                # 日历控件仍选中对应的公历日期，农历日期显示在旁边
                 self.date_type.set('农历')
-                self.cal.selection_set(lunar_date.toSolarDate())
+                self._set_lunar((lunar.year, lunar.month, lunar.day), lunar.leap)
             else:
-                lunar_date = LunarDate.fromSolarDate(*self._parse_date())
-                solar_date = lunar_date.toSolarDate()
-                self.date_type.set('公历')
+                solar_date = bazi_lunar.to_solar(year, month, day, self.is_leap_month)
                 self.cal.selection_set(solar_date)
+                self.date_type.set('公历')
+                self._set_lunar(None)
         except Exception as e:
             tk.messagebox.showerror("转换错误", str(e))
 
+    def _parse_date(self) -> tuple:
+        """当前日期的年月日：农历模式下优先取转换得到的农历日期"""
+        if self.date_type.get() == '农历' and self.lunar_date is not None:
+            return self.lunar_date
+        selected = self.cal.selection_get()
+        return selected.year, selected.month, selected.day
+
     def get_datetime(self) -> datetime:
         """获取输入的日期时间"""
         try:
             # 解析日期
-            year, month, day = map(int, self.cal.get_date().split('-'))
+            year, month, day = self._parse_date()
             
             # 处理农历转换
             if self.date_type.get() == '农历':
-                lunar_date = LunarDate(year, month, day)
-                solar_date = lunar_date.toSolarDate()
+                solar_date = bazi_lunar.to_solar(year, month, day, self.is_leap_month)
                 year, month, day = solar_date.year, solar_date.month, solar_date.day
 
             # 解析时间
@@ -101,6 +129,7 @@ class DateTimeEntry(ttk.Frame):
                 raise ValueError("时间值无效")
             
             # 构建时区感知的datetime对象
+            import pytz
             tz_name = dict(self.TIMEZONES)[self.tz_combobox.get()]
             return pytz.timezone(tz_name).localize(
                 datetime(year, month, day, hour, minute)
@@ -110,6 +139,7 @@ class DateTimeEntry(ttk.Frame):
 
     def set_default_time(self):
         """设置默认时间为当前时间"""
+        import pytz
         now = datetime.now(pytz.timezone('Asia/Shanghai'))
         self.cal.selection_set(now.date())
         self.time_entry.delete(0, tk.END)
@@ -0,0 +1,174 @@
+"""本地 OpenAI 兼容桩服务
+
+用于在不访问真实接口的情况下测试 BaziAnalyzer / AsyncBaziAnalyzer：
+支持 /v1/chat/completions 的流式与非流式响应，可配置延迟、限流与服务端错误；
+设置 reasoning 时像 deepseek-reasoner 一样先以 reasoning_content 输出思考过程。
+
+    with FakeOpenAIServer(latency=0.2) as server:
+        analyzer = BaziAnalyzer("sk-test", base_url=server.base_url)
+
+也可以单独运行：python fake_openai_server.py --port 8000 --latency 0.5
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "🔹命局如春水初生，木火相生。\n🔹五行偏旺于金，宜补木。\n🔹适合从事创意类工作。"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        server = self.server.owner
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request"}})
+            return
+
+        number = server._next_request()
+        if server.rate_limit_every and number % server.rate_limit_every == 0:
+            self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                            {"Retry-After": str(server.retry_after)})
+            return
+        if server.error_every and number % server.error_every == 0:
+            self._send_json(server.error_status,
+                            {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+
+        model = request.get("model", "fake-model")
+        reply = server.reply
+        usage = {"prompt_tokens": sum(len(m.get("content", "")) for m in request.get("messages", [])),
+                 "completion_tokens": len(reply)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        try:
+            if not request.get("stream"):
+                self._send_json(200, {
+                    "id": f"chatcmpl-{number}", "object": "chat.completion",
+                    "created": int(time.time()), "model": model, "usage": usage,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": reply,
+                                             "reasoning_content": server.reasoning or None}}],
+                })
+            else:
+                self._stream(server, number, model, reply, usage)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端中途取消
+            self.close_connection = True
+
+    def _stream(self, server, number, model, reply, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = server.chunk_chars
+        pieces = [("reasoning_content", server.reasoning[i:i + size])
+                  for i in range(0, len(server.reasoning), size)]
+        pieces += [("content", reply[i:i + size]) for i in range(0, len(reply), size)]
+        for index, (field, piece) in enumerate(pieces):
+            if index and server.chunk_delay:
+                time.sleep(server.chunk_delay)
+            chunk = {
+                "id": f"chatcmpl-{number}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"role": "assistant", field: piece}}],
+            }
+            self._write_chunk(b"data: " + json.dumps(chunk, ensure_ascii=False).encode() + b"\n\n")
+        final = {"id": f"chatcmpl-{number}", "object": "chat.completion.chunk",
+                 "created": int(time.time()), "model": model, "usage": usage,
+                 "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+        self._write_chunk(b"data: " + json.dumps(final).encode() + b"\n\n")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class FakeOpenAIServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, reply: str = DEFAULT_REPLY,
+                 latency: float = 0.0, chunk_delay: float = 0.0, chunk_chars: int = 8,
+                 rate_limit_every: int = 0, retry_after: float = 0.05, reasoning: str = "",
+                 error_every: int = 0, error_status: int = 500):
+        """各参数均可在运行中修改，例如把 error_every 设为 1 模拟服务整体故障"""
+        self.reply = reply
+        self.reasoning = reasoning
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = chunk_chars
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.error_every = error_every
+        self.error_status = error_status
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _next_request(self) -> int:
+        with self._lock:
+            self.request_count += 1
+            return self.request_count
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="首字节前的延迟（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="流式分块间隔（秒）")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="每N个请求返回一次429")
+    parser.add_argument("--error-every", type=int, default=0, help="每N个请求返回一次服务端错误")
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.host, args.port, latency=args.latency,
+                              chunk_delay=args.chunk_delay, rate_limit_every=args.rate_limit_every,
+                              error_every=args.error_every, error_status=args.error_status)
+    print(f"桩服务已启动：{server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
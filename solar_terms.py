@@ -0,0 +1,222 @@
+"""二十四节气表
+
+节气时刻由太阳视黄经计算（VSOP87 地球黄经截断级数 + 章动 + 光行差，
+参见 Meeus《天文算法》第25、32章），以UTC秒（int64）顺序存放：
+下标 i 对应 FIRST_YEAR + i // 24 年的第 i % 24 个节气（从小寒起）。
+表在首次使用时从 solar_terms.bin 加载，文件缺失时现场计算。
+重新生成数据文件：python solar_terms.py
+"""
+import math
+import os
+import sys
+from array import array
+from bisect import bisect_right
+
+TERM_NAMES = (
+    "小寒", "大寒", "立春", "雨水", "惊蛰", "春分",
+    "清明", "谷雨", "立夏", "小满", "芒种", "夏至",
+    "小暑", "大暑", "立秋", "处暑", "白露", "秋分",
+    "寒露", "霜降", "立冬", "小雪", "大雪", "冬至",
+)
+FIRST_YEAR = 1799
+LAST_YEAR = 2201
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "solar_terms.bin")
+
+_TABLE = None
+
+# VSOP87 地球日心黄经级数（A, B, C），单位 1e-8 弧度
+_L0 = (
+    (175347046, 0, 0), (3341656, 4.6692568, 6283.07585), (34894, 4.6261, 12566.1517),
+    (3497, 2.7441, 5753.3849), (3418, 2.8289, 3.5231), (3136, 3.6277, 77713.7715),
+    (2676, 4.4181, 7860.4194), (2343, 6.1352, 3930.2097), (1324, 0.7425, 11506.7698),
+    (1273, 2.0371, 529.691), (1199, 1.1096, 1577.3435), (990, 5.233, 5884.927),
+    (902, 2.045, 26.298), (857, 3.508, 398.149), (780, 1.179, 5223.694),
+    (753, 2.533, 5507.553), (505, 4.583, 18849.228), (492, 4.205, 775.523),
+    (357, 2.92, 0.067), (317, 5.849, 11790.629), (284, 1.899, 796.298),
+    (271, 0.315, 10977.079), (243, 0.345, 5486.778), (206, 4.806, 2544.314),
+    (205, 1.869, 5573.143), (202, 2.458, 6069.777), (156, 0.833, 213.299),
+    (132, 3.411, 2942.463), (126, 1.083, 20.775), (115, 0.645, 0.98),
+    (103, 0.636, 4694.003), (102, 0.976, 15720.839), (102, 4.267, 7.114),
+    (99, 6.21, 2146.17), (98, 0.68, 155.42), (86, 5.98, 161000.69),
+    (85, 1.3, 6275.96), (85, 3.67, 71430.7), (80, 1.81, 17260.15),
+    (79, 3.04, 12036.46), (75, 1.76, 5088.63), (74, 3.5, 3154.69),
+    (74, 4.68, 801.82), (70, 0.83, 9437.76), (62, 3.98, 8827.39),
+    (61, 1.82, 7084.9), (57, 2.78, 6286.6), (56, 4.39, 14143.5),
+    (56, 3.47, 6279.55), (52, 0.19, 12139.55), (52, 1.33, 1748.02),
+    (51, 0.28, 5856.48), (49, 0.49, 1194.45), (41, 5.37, 8429.24),
+    (41, 2.4, 19651.05), (39, 6.17, 10447.39), (37, 6.04, 10213.29),
+    (37, 2.57, 1059.38), (36, 1.71, 2352.87), (36, 1.78, 6812.77),
+    (33, 0.59, 17789.85), (30, 0.44, 83996.85), (30, 2.74, 1349.87),
+    (25, 3.16, 4690.48),
+)
+_L1 = (
+    (628331966747, 0, 0), (206059, 2.678235, 6283.07585), (4303, 2.6351, 12566.1517),
+    (425, 1.59, 3.523), (119, 5.796, 26.298), (109, 2.966, 1577.344),
+    (93, 2.59, 18849.23), (72, 1.14, 529.69), (68, 1.87, 398.15),
+    (67, 4.41, 5507.55), (59, 2.89, 5223.69), (56, 2.17, 155.42),
+    (45, 0.4, 796.3), (36, 0.47, 775.52), (29, 2.65, 7.11),
+    (21, 5.34, 0.98), (19, 1.85, 5486.78), (19, 4.97, 213.3),
+    (17, 2.99, 6275.96), (16, 0.03, 2544.31), (16, 1.43, 2146.17),
+    (15, 1.21, 10977.08), (12, 2.83, 1748.02), (12, 3.26, 5088.63),
+    (12, 5.27, 1194.45), (12, 2.08, 4694.0), (11, 0.77, 553.57),
+    (10, 1.3, 6286.6), (10, 4.24, 1349.87), (9, 2.7, 242.73),
+    (9, 5.64, 951.72), (8, 5.3, 2352.87), (6, 2.65, 9437.76),
+    (6, 4.67, 4690.48),
+)
+_L2 = (
+    (52919, 0, 0), (8720, 1.0721, 6283.0758), (309, 0.867, 12566.152),
+    (27, 0.05, 3.52), (16, 5.19, 26.3), (16, 3.68, 155.42),
+    (10, 0.76, 18849.23), (9, 2.06, 77713.77), (7, 0.83, 775.52),
+    (5, 4.66, 1577.34), (4, 1.03, 7.11), (4, 3.44, 5573.14),
+    (3, 5.14, 796.3), (3, 6.05, 5507.55), (3, 1.19, 242.73),
+    (3, 6.12, 529.69), (3, 0.31, 398.15), (3, 2.28, 553.57),
+    (2, 4.38, 5223.69), (2, 3.75, 0.98),
+)
+_L3 = (
+    (289, 5.844, 6283.076), (35, 0, 0), (17, 5.49, 12566.15),
+    (3, 5.2, 155.42), (1, 4.72, 3.52), (1, 5.3, 18849.23),
+    (1, 5.97, 242.73),
+)
+_L4 = ((114, 3.142, 0), (8, 4.13, 6283.08), (1, 3.84, 12566.15))
+_L5 = ((1, 3.14, 0),)
+_R0 = (
+    (100013989, 0, 0), (1670700, 3.0984635, 6283.07585), (13956, 3.05525, 12566.1517),
+    (3084, 5.1985, 77713.7715), (1628, 1.1739, 5753.3849), (1576, 2.8469, 7860.4194),
+)
+_R1 = ((103019, 1.10749, 6283.07585), (1721, 1.0644, 12566.1517))
+
+
+def _series(terms, tau: float) -> float:
+    return sum(a * math.cos(b + c * tau) for a, b, c in terms)
+
+
+def _delta_t(year: float) -> float:
+    """TT - UT（秒），Espenak & Meeus 多项式"""
+    if year < 1800:
+        u = (year - 1820) / 100
+        return -20 + 32 * u * u
+    if year < 1860:
+        t = year - 1800
+        return (13.72 - 0.332447 * t + 0.0068612 * t ** 2 + 0.0041116 * t ** 3
+                - 0.00037436 * t ** 4 + 0.0000121272 * t ** 5
+                - 0.0000001699 * t ** 6 + 0.000000000875 * t ** 7)
+    if year < 1900:
+        t = year - 1860
+        return (7.62 + 0.5737 * t - 0.251754 * t ** 2 + 0.01680668 * t ** 3
+                - 0.0004473624 * t ** 4 + t ** 5 / 233174)
+    if year < 1920:
+        t = year - 1900
+        return -2.79 + 1.494119 * t - 0.0598939 * t ** 2 + 0.0061966 * t ** 3 - 0.000197 * t ** 4
+    if year < 1941:
+        t = year - 1920
+        return 21.20 + 0.84493 * t - 0.0761 * t ** 2 + 0.0020936 * t ** 3
+    if year < 1961:
+        t = year - 1950
+        return 29.07 + 0.407 * t - t ** 2 / 233 + t ** 3 / 2547
+    if year < 1986:
+        t = year - 1975
+        return 45.45 + 1.067 * t - t ** 2 / 260 - t ** 3 / 718
+    if year < 2005:
+        t = year - 2000
+        return (63.86 + 0.3345 * t - 0.060374 * t ** 2 + 0.0017275 * t ** 3
+                + 0.000651814 * t ** 4 + 0.00002373599 * t ** 5)
+    if year < 2050:
+        t = year - 2000
+        return 62.92 + 0.32217 * t + 0.005589 * t ** 2
+    if year < 2150:
+        return -20 + 32 * ((year - 1820) / 100) ** 2 - 0.5628 * (2150 - year)
+    u = (year - 1820) / 100
+    return -20 + 32 * u * u
+
+
+def apparent_longitude(jde: float) -> float:
+    """太阳视黄经（度），jde 为力学时儒略日"""
+    tau = (jde - 2451545.0) / 365250
+    longitude = (_series(_L0, tau) + _series(_L1, tau) * tau + _series(_L2, tau) * tau ** 2
+                 + _series(_L3, tau) * tau ** 3 + _series(_L4, tau) * tau ** 4
+                 + _series(_L5, tau) * tau ** 5) / 1e8
+    radius = (_series(_R0, tau) + _series(_R1, tau) * tau) / 1e8
+
+    t = tau * 10
+    sun = math.degrees(longitude) + 180
+    # 转到 FK5 系统
+    sun -= 0.09033 / 3600
+    # 章动（主要项）与光行差
+    omega = math.radians(125.04452 - 1934.136261 * t)
+    mean_sun = math.radians(280.4665 + 36000.7698 * t)
+    mean_moon = math.radians(218.3165 + 481267.8813 * t)
+    nutation = (-17.20 * math.sin(omega) - 1.32 * math.sin(2 * mean_sun)
+                - 0.23 * math.sin(2 * mean_moon) + 0.21 * math.sin(2 * omega))
+    sun += (nutation - 20.4898 / radius) / 3600
+    return sun % 360
+
+
+def compute_term(year: int, index: int) -> int:
+    """计算某年第 index 个节气（0 为小寒）的UTC时刻（秒）"""
+    target = (285 + 15 * index) % 360
+    # 小寒约在1月6日，之后每个节气间隔约15.2天
+    jde = 367 * year - 7 * year // 4 + 1721013.5 + 36 + index * 15.2184
+    for _ in range(20):
+        delta = (target - apparent_longitude(jde) + 180) % 360 - 180
+        jde += delta * 365.2422 / 360
+        if abs(delta) < 1e-8:
+            break
+    jd_ut = jde - _delta_t(year + index / 24) / 86400
+    return round((jd_ut - 2440587.5) * 86400)
+
+
+def generate_table(first_year: int = FIRST_YEAR, last_year: int = LAST_YEAR) -> array:
+    return array("q", (compute_term(year, index)
+                       for year in range(first_year, last_year + 1)
+                       for index in range(24)))
+
+
+def load_table() -> array:
+    """惰性加载节气表"""
+    global _TABLE
+    if _TABLE is None:
+        expected = (LAST_YEAR - FIRST_YEAR + 1) * 24
+        table = array("q")
+        try:
+            with open(TABLE_PATH, "rb") as f:
+                table.frombytes(f.read())
+            if sys.byteorder == "big":
+                table.byteswap()
+        except OSError:
+            pass
+        if len(table) != expected:
+            table = generate_table()
+        _TABLE = table
+    return _TABLE
+
+
+def save_table(path: str = TABLE_PATH):
+    table = array("q", load_table())
+    if sys.byteorder == "big":
+        table.byteswap()
+    with open(path, "wb") as f:
+        table.tofile(f)
+
+
+def locate(seconds: float) -> int:
+    """返回 seconds 时刻所处节气在表中的下标"""
+    table = load_table()
+    index = bisect_right(table, seconds) - 1
+    if index < 0 or index >= len(table) - 1:
+        raise ValueError(f"超出节气表范围（{FIRST_YEAR}-{LAST_YEAR}年）")
+    return index
+
+
+def term_time(year: int, term: str) -> int:
+    """某年指定节气的UTC时刻（秒）"""
+    if term not in TERM_NAMES:
+        raise ValueError(f"未知节气：{term}")
+    if not FIRST_YEAR <= year <= LAST_YEAR:
+        raise ValueError(f"超出节气表范围（{FIRST_YEAR}-{LAST_YEAR}年）")
+    return load_table()[(year - FIRST_YEAR) * 24 + TERM_NAMES.index(term)]
+
+
+if __name__ == "__main__":
+    _TABLE = generate_table()
+    save_table()
+    print(f"已生成 {TABLE_PATH}：{FIRST_YEAR}-{LAST_YEAR}年，共 {len(_TABLE)} 个节气")
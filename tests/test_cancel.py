@@ -0,0 +1,58 @@
+"""取消任务时中止进行中的分析请求（非流式同样生效）"""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("openai")
+
+from bazi_analysis import BaziAnalyzer
+from bazi_jobs import Job
+from bazi_providers import Provider, ProviderRegistry
+from fake_openai_server import FakeOpenAIServer
+
+REPORT = {"sizhu": {"year": "甲子", "month": "丙寅", "day": "戊辰", "hour": "庚申"}}
+
+
+def run_cancelled(server, cancel_after: float) -> tuple:
+    """在线程中做一次非流式分析，cancel_after 秒后取消任务，返回 (结果, 取消到返回的秒数)"""
+    registry = ProviderRegistry([Provider("fake", server.base_url)])
+    analyzer = BaziAnalyzer("sk-test", providers=registry)
+    job = Job(None, 0)
+    result = {}
+
+    def work():
+        result["value"] = analyzer.analyze(REPORT, on_cancel=job.on_cancel)
+        result["returned"] = time.perf_counter()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    time.sleep(cancel_after)
+    cancelled = time.perf_counter()
+    job.cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    return result["value"], result["returned"] - cancelled
+
+
+def test_cancel_before_response_returns_immediately():
+    with FakeOpenAIServer(latency=2.0) as server:
+        value, waited = run_cancelled(server, 0.2)
+    assert waited < 0.5
+    assert "取消" in value
+
+
+def test_cancel_while_generating_closes_connection():
+    reply = "🔹" + "命理分析" * 100
+    with FakeOpenAIServer(reply=reply, chunk_chars=4, chunk_delay=0.02) as server:
+        value, waited = run_cancelled(server, 0.3)
+    assert waited < 0.5
+    assert value != reply
+
+
+def test_uncancelled_request_still_returns_full_reply():
+    with FakeOpenAIServer() as server:
+        registry = ProviderRegistry([Provider("fake", server.base_url)])
+        analyzer = BaziAnalyzer("sk-test", providers=registry)
+        job = Job(None, 0)
+        assert analyzer.analyze(REPORT, on_cancel=job.on_cancel) == server.reply
@@ -0,0 +1,35 @@
+"""多进程排盘：工作进程反复崩溃时只影响出问题的块"""
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from bazi_cli import chart_records
+from bazi_parallel import ParallelCharter
+
+CRASH = "1990-01-01T00:00"
+
+
+def _crash_on_marker(records, default_timezone):
+    if any(r["datetime"] == CRASH for r in records):
+        os._exit(1)
+    return chart_records(records, default_timezone)
+
+
+class CrashingCharter(ParallelCharter):
+    work = staticmethod(_crash_on_marker)
+
+
+def test_chunk_that_always_crashes_is_isolated():
+    # 单个工作进程、坏记录在队首：重试时其后的块必定已因进程池损坏而被置空
+    records = [{"datetime": CRASH}] + [{"datetime": f"1990-0{month}-15T12:00"}
+                                       for month in range(2, 10)]
+    charter = CrashingCharter(workers=1, chunk_size=1, max_retries=2)
+
+    rows = [row for chunk in charter.map(records) for row in chunk]
+
+    assert [row["datetime"] for row in rows] == [r["datetime"] for r in records]
+    assert "分片处理失败" in rows[0]["error"]
+    assert all("error" not in row for row in rows[1:])
+    assert charter.failed_chunks == 1
@@ -0,0 +1,125 @@
+"""对冲、故障切换与熔断：用两个本地桩服务驱动 BaziAnalyzer"""
+import asyncio
+import time
+
+import pytest
+
+# 预先导入，以免首个请求的耗时里包含 openai 的导入
+pytest.importorskip("openai")
+
+from bazi_analysis import AsyncBaziAnalyzer, BaziAnalyzer
+from bazi_providers import Provider, ProviderRegistry
+from fake_openai_server import FakeOpenAIServer
+
+REPORT = {"sizhu": {"year": "甲子", "month": "丙寅", "day": "戊辰", "hour": "庚申"}}
+PRIMARY_REPLY = "🔹主服务的回答。"
+BACKUP_REPLY = "🔹备用服务的回答。"
+# 权重相差悬殊，使候选顺序确定（u^(1/w) 排序）
+FIRST, SECOND = 1000.0, 0.001
+
+
+@pytest.fixture
+def servers():
+    with FakeOpenAIServer(reply=PRIMARY_REPLY) as primary, \
+            FakeOpenAIServer(reply=BACKUP_REPLY) as backup:
+        yield primary, backup
+
+
+def make_registry(primary, backup, **options):
+    options.setdefault("hedge_delay", 0.1)
+    return ProviderRegistry([Provider("primary", primary.base_url, weight=FIRST),
+                             Provider("backup", backup.base_url, weight=SECOND)], **options)
+
+
+def provider(registry, name):
+    return next(p for p in registry.providers if p.name == name)
+
+
+def test_slow_primary_is_hedged(servers):
+    primary, backup = servers
+    primary.latency = 1.0
+    registry = make_registry(primary, backup)
+    analyzer = BaziAnalyzer("sk-test", providers=registry)
+
+    started = time.perf_counter()
+    stream = analyzer.analyze(REPORT, stream=True)
+    first = next(iter(stream))
+    assert time.perf_counter() - started < 0.6
+    assert "".join([first, *stream]) == BACKUP_REPLY
+    assert primary.request_count == backup.request_count == 1
+
+
+def test_hedge_loser_records_latency_sample(servers):
+    primary, backup = servers
+    primary.latency = 0.5
+    registry = make_registry(primary, backup)
+
+    async def run():
+        async with AsyncBaziAnalyzer("sk-test", providers=registry) as analyzer:
+            for _ in range(5):
+                assert await analyzer.analyze(REPORT) == BACKUP_REPLY
+
+    asyncio.run(run())
+    slow = provider(registry, "primary")
+    assert slow.requests == 5
+    # 落败时已等待的时长是延迟的下界，样本足够后对冲延迟随之调整
+    assert slow.percentile("response") >= 0.1
+    assert registry.hedge_delay(slow, stream=False) == slow.percentile("response")
+
+
+def test_server_error_fails_over(servers):
+    primary, backup = servers
+    primary.error_every = 1
+    registry = make_registry(primary, backup)
+    analyzer = BaziAnalyzer("sk-test", providers=registry, hedge=False)
+
+    assert analyzer.analyze(REPORT) == BACKUP_REPLY
+    assert primary.request_count == 1
+    assert provider(registry, "primary").errors == 1
+
+
+def test_breaker_opens_and_recovers(servers):
+    primary, backup = servers
+    primary.error_every = 1
+    registry = make_registry(primary, backup, failure_threshold=2, cooldown=0.2)
+    analyzer = BaziAnalyzer("sk-test", providers=registry, hedge=False)
+    main = provider(registry, "primary")
+
+    for _ in range(2):
+        assert analyzer.analyze(REPORT) == BACKUP_REPLY
+    assert main.opened_at is not None
+    assert analyzer.analyze(REPORT) == BACKUP_REPLY
+    assert primary.request_count == 2      # 熔断期间不再发往主服务
+
+    primary.error_every = 0
+    time.sleep(0.25)
+    # 冷却后主服务排在后面：备用服务直接成功，主服务没有发出请求，也不应占住试探名额
+    main.weight, provider(registry, "backup").weight = SECOND, FIRST
+    assert analyzer.analyze(REPORT) == BACKUP_REPLY
+    assert primary.request_count == 2
+    assert not main.trial
+
+    main.weight, provider(registry, "backup").weight = FIRST, SECOND
+    assert analyzer.analyze(REPORT) == PRIMARY_REPLY
+    assert main.opened_at is None
+    assert analyzer.analyze(REPORT) == PRIMARY_REPLY
+
+
+def test_trial_answered_with_client_error_closes_breaker(servers):
+    primary, backup = servers
+    primary.error_every = 1
+    registry = make_registry(primary, backup, failure_threshold=1, cooldown=0.1)
+    analyzer = BaziAnalyzer("sk-test", providers=registry, hedge=False)
+    main = provider(registry, "primary")
+
+    assert analyzer.analyze(REPORT) == BACKUP_REPLY
+    assert main.opened_at is not None
+
+    # 试探请求得到 4xx：服务能应答，熔断应当关闭而不是永久占住试探名额
+    primary.error_status = 400
+    time.sleep(0.15)
+    assert analyzer.analyze(REPORT).startswith("API错误（400）")
+    assert main.opened_at is None and not main.trial
+
+    primary.error_every = 0
+    assert analyzer.analyze(REPORT) == PRIMARY_REPLY